@@ -2,21 +2,334 @@
 本地数据库模块 - SQLite作为Single Source of Truth
 遵循PRD v1.1第3、4章节的数据架构规范
 """
+import os
+import queue
+import json
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from itertools import groupby, islice
 from pathlib import Path
-from datetime import datetime
-from typing import Optional, List, Dict
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Iterable, Tuple
 from contextlib import contextmanager
 
+import numpy as np
+
 # 数据库路径
 DB_PATH = Path(__file__).parent.parent / "data" / "fund_trend.db"
 
+# 每个连接都需要设置的运行时PRAGMA（journal_mode=WAL 是持久化的，只在 init_database 设置一次）
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",      # WAL模式下NORMAL即可保证一致性，减少fsync
+    "PRAGMA cache_size=-64000",       # 64MB页缓存
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_spill=OFF",         # 大事务期间不把脏页溢出到数据库文件
+    "PRAGMA mmap_size=268435456",     # 256MB内存映射
+    "PRAGMA busy_timeout=5000",       # 写锁等待5秒，避免 database is locked
+    "PRAGMA foreign_keys=ON",         # ON DELETE CASCADE 依赖外键约束
+)
+
+
+def _apply_pragmas(conn: sqlite3.Connection) -> None:
+    """为新连接设置运行时PRAGMA"""
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+
+
+# ==================== SQL语句 ====================
+# 语句文本定义为模块常量，配合连接池的语句缓存（cached_statements）每个连接只编译一次
+
+SQL_GET_INSTRUMENT = "SELECT code, name, type FROM instrument WHERE code = ?"
+
+SQL_LIST_INSTRUMENTS_BY_TYPE = "SELECT code, name, type FROM instrument WHERE type = ? ORDER BY code"
+
+SQL_LIST_INSTRUMENTS = "SELECT code, name, type FROM instrument ORDER BY code"
+
+SQL_LIST_INSTRUMENT_CODES = "SELECT code FROM instrument ORDER BY code"
+
+SQL_UPSERT_INSTRUMENT = """
+    INSERT INTO instrument (code, name, type, source, updated_at)
+    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(code) DO UPDATE SET
+        name = excluded.name,
+        type = excluded.type,
+        source = excluded.source,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+SQL_DELETE_INSTRUMENT = "DELETE FROM instrument WHERE code = ?"
+
+SQL_GET_TIMESERIES = """
+    SELECT date, value FROM timeseries_daily
+    WHERE code = ? AND date >= ? AND date < ?
+    ORDER BY date ASC
+"""
+
+# end_date 不是规范日期、求不出下一天时的闭区间写法，按字符串比较
+SQL_GET_TIMESERIES_THROUGH = """
+    SELECT date, value FROM timeseries_daily
+    WHERE code = ? AND date >= ? AND date <= ?
+    ORDER BY date ASC
+"""
+
+SQL_UPSERT_TIMESERIES = """
+    INSERT INTO timeseries_daily (code, date, value, source_version)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(code, date) DO UPDATE SET
+        value = excluded.value,
+        source_version = excluded.source_version
+"""
+
+# 多个代码的整段序列，IN 列表的占位符按批次大小拼接
+SQL_GET_TIMESERIES_BATCH = """
+    SELECT code, date, value FROM timeseries_daily
+    WHERE code IN ({placeholders})
+    ORDER BY code, date ASC
+"""
+
+SQL_GET_TIMESERIES_BLOB = "SELECT dates, price_values FROM timeseries_blob WHERE code = ?"
+
+SQL_GET_TIMESERIES_BLOB_BATCH = """
+    SELECT code, dates, price_values FROM timeseries_blob
+    WHERE code IN ({placeholders})
+"""
+
+SQL_SAVE_TIMESERIES_BLOB = """
+    INSERT OR REPLACE INTO timeseries_blob (code, dates, price_values)
+    VALUES (?, ?, ?)
+"""
+
+SQL_DELETE_TIMESERIES_BLOB = "DELETE FROM timeseries_blob WHERE code = ?"
+
+SQL_UPDATE_SYNC_STATE = """
+    INSERT INTO sync_state (code, last_success_date, last_sync_at, status, message)
+    VALUES (?, ?, CURRENT_TIMESTAMP, ?, ?)
+    ON CONFLICT(code) DO UPDATE SET
+        last_success_date = excluded.last_success_date,
+        last_sync_at = excluded.last_sync_at,
+        status = excluded.status,
+        message = excluded.message
+"""
+
+SQL_GET_SYNC_STATE = """
+    SELECT code, last_success_date, last_sync_at, status, message
+    FROM sync_state WHERE code = ?
+"""
+
+SQL_GET_DATA_VERSION = """
+    SELECT i.updated_at, s.last_success_date, s.last_sync_at
+    FROM instrument i LEFT JOIN sync_state s ON s.code = i.code
+    WHERE i.code = ?
+"""
+
+SQL_GET_INSTRUMENTS_VERSION = "SELECT COUNT(*), MAX(updated_at) FROM instrument"
+
+SQL_SAVE_USER_STATE = """
+    INSERT INTO user_state (key, value, updated_at)
+    VALUES (?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(key) DO UPDATE SET
+        value = excluded.value,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+SQL_LOAD_USER_STATE = "SELECT value FROM user_state WHERE key = ?"
+
+SQL_LIST_FAVORITES = "SELECT code FROM favorites ORDER BY rowid"
+
+SQL_ADD_FAVORITE = "INSERT OR IGNORE INTO favorites (code) VALUES (?)"
+
+SQL_REMOVE_FAVORITE = "DELETE FROM favorites WHERE code = ?"
+
+SQL_SAVE_SURGE_EVENT = """
+    INSERT OR REPLACE INTO surge_events
+    (code, start_date, end_date, window, total_gain, slope_first, slope_second, is_accelerating)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_CLEAR_SURGE_EVENTS = "DELETE FROM surge_events"
+
+SQL_GET_SURGE_EVENTS = """
+    SELECT id, code, start_date, end_date, window, total_gain,
+           slope_first, slope_second, is_accelerating
+    FROM surge_events WHERE code = ? ORDER BY start_date DESC
+"""
+
+SQL_DELETE_UPTREND_PHASES = "DELETE FROM uptrend_phases WHERE code = ?"
+
+SQL_INSERT_UPTREND_PHASE = """
+    INSERT INTO uptrend_phases
+    (code, start_date, end_date, duration_days, total_gain, max_drawdown,
+     avg_daily_gain, slope_first, slope_second, is_accelerating)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_MARK_UPTREND_PHASES = """
+    INSERT OR REPLACE INTO uptrend_phases_state (code, computed_at)
+    VALUES (?, CURRENT_TIMESTAMP)
+"""
+
+SQL_DELETE_UPTREND_PHASES_STATE = "DELETE FROM uptrend_phases_state WHERE code = ?"
+
+SQL_HAS_UPTREND_PHASES = "SELECT 1 FROM uptrend_phases_state WHERE code = ?"
+
+SQL_GET_UPTREND_PHASES = """
+    SELECT start_date, end_date, duration_days, total_gain, max_drawdown,
+           avg_daily_gain, slope_first, slope_second, is_accelerating
+    FROM uptrend_phases
+    WHERE code = ? AND total_gain >= ? AND duration_days >= ?
+    ORDER BY start_date ASC
+"""
+
+
+SQL_SAVE_INDICATORS = """
+    INSERT OR REPLACE INTO indicators_daily
+    (code, date, days, momentum, relative_strength, index_return,
+     volatility, vol_ratio, analysis, warning_level, score, index_date)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_DELETE_INDICATORS = "DELETE FROM indicators_daily WHERE code = ?"
+
+SQL_GET_LATEST_INDICATORS = """
+    SELECT code, days, momentum, relative_strength, index_return,
+           volatility, vol_ratio, analysis, warning_level, score, index_date
+    FROM indicators_daily
+    WHERE code = ? AND days = ?
+    ORDER BY date DESC LIMIT 1
+"""
+
+
+class ConnectionPool:
+    """
+    SQLite长连接池
+
+    连接创建时设置好PRAGMA，之后在请求间复用，保持页缓存和mmap热数据。
+    FastAPI在线程池中执行同步代码，因此连接以 check_same_thread=False 打开，
+    同一时刻只借给一个线程使用。
+    连接不能跨进程使用，fork 出的子进程通过 pid 判断后会另建自己的连接池。
+    """
+
+    def __init__(self, db_path: Path, size: int = 8, read_only: bool = False):
+        self.db_path = db_path
+        self.size = size
+        self.read_only = read_only
+        self.pid = os.getpid()
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.read_only:
+            # 只读连接不获取写锁、不需要回滚日志
+            target, uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro", True
+        else:
+            target, uri = self.db_path, False
+        conn = sqlite3.connect(
+            target,
+            uri=uri,
+            check_same_thread=False,
+            cached_statements=256
+        )
+        conn.row_factory = sqlite3.Row  # 返回字典格式
+        _apply_pragmas(conn)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """借出一个连接，池未满时按需创建，否则等待归还"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get()
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """归还连接"""
+        self._idle.put(conn)
+
+    def warm(self) -> None:
+        """预先建满连接，首批请求不再承担建连和 PRAGMA 设置的开销"""
+        while True:
+            with self._lock:
+                if self._created >= self.size:
+                    return
+                self._created += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            self._idle.put(conn)
+
+    def close(self) -> None:
+        """关闭所有空闲连接"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            # 关闭前按本连接的查询模式更新统计信息（只读连接无法写入统计表）
+            if not self.read_only:
+                conn.execute("PRAGMA optimize")
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+_pools: Dict[bool, ConnectionPool] = {}
+_pool_lock = threading.Lock()
+
+
+def get_pool(read_only: bool = False) -> ConnectionPool:
+    """获取全局连接池（首次使用时按当前 DB_PATH 创建），读写与只读各一个"""
+    pool = _pools.get(read_only)
+    if pool is None or pool.db_path != DB_PATH or pool.pid != os.getpid():
+        with _pool_lock:
+            pool = _pools.get(read_only)
+            if pool is None or pool.db_path != DB_PATH or pool.pid != os.getpid():
+                # 从父进程继承的连接池直接丢弃，不能在子进程里关闭父进程的连接
+                if pool is not None and pool.pid == os.getpid():
+                    pool.close()
+                pool = _pools[read_only] = ConnectionPool(DB_PATH, read_only=read_only)
+    return pool
+
+
+def warm_pools() -> None:
+    """预热读写与只读连接池"""
+    get_pool().warm()
+    get_pool(read_only=True).warm()
+
+
+def close_pool() -> None:
+    """关闭全局连接池"""
+    with _pool_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
 
 @contextmanager
 def get_db():
-    """获取数据库连接上下文管理器"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row  # 返回字典格式
+    """获取数据库连接上下文管理器（从连接池借出，结束后归还）"""
+    pool = get_pool()
+    conn = pool.acquire()
     try:
         yield conn
         conn.commit()
@@ -24,7 +337,31 @@ def get_db():
         conn.rollback()
         raise
     finally:
-        conn.close()
+        pool.release(conn)
+
+
+@contextmanager
+def get_db_ro():
+    """获取只读数据库连接上下文管理器，供查询类函数使用"""
+    pool = get_pool(read_only=True)
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        # 结束隐式读事务，避免长期持有旧快照
+        conn.rollback()
+        pool.release(conn)
+
+
+def optimize_database() -> None:
+    """
+    数据库定期维护：更新查询规划统计信息，并截断WAL文件
+
+    由后台任务定期调用，避免 -wal 文件无限增长影响读性能
+    """
+    with get_db() as conn:
+        conn.execute("PRAGMA optimize")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
 
 
 def init_database():
@@ -32,6 +369,9 @@ def init_database():
     with get_db() as conn:
         cursor = conn.cursor()
 
+        # WAL模式持久化在数据库文件中，读写互不阻塞
+        cursor.execute("PRAGMA journal_mode=WAL")
+
         # 1. instrument 表 - 存储基金/指数基本信息
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS instrument (
@@ -56,10 +396,22 @@ def init_database():
             )
         """)
 
-        # 为时间序列查询创建索引
+        # 为时间序列查询创建覆盖索引（包含value，范围扫描无需回表）
         cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_timeseries_code_date
-            ON timeseries_daily(code, date DESC)
+            CREATE INDEX IF NOT EXISTS idx_ts_covering
+            ON timeseries_daily(code, date, value)
+        """)
+        cursor.execute("DROP INDEX IF EXISTS idx_timeseries_code_date")
+
+        # 整段净值序列的连续存储：日期以换行拼接，净值为 float64 小端字节串，
+        # 整段读取只需一次主键查找 + np.frombuffer；写入时间序列时删除，下次读取时重建
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS timeseries_blob (
+                code TEXT PRIMARY KEY,
+                dates TEXT NOT NULL,
+                price_values BLOB NOT NULL,
+                FOREIGN KEY (code) REFERENCES instrument(code) ON DELETE CASCADE
+            )
         """)
 
         # 3. sync_state 表 - 记录同步状态
@@ -83,6 +435,22 @@ def init_database():
             )
         """)
 
+        # 收藏表 - 每个收藏代码一行，替代 user_state 中的 favorites JSON
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS favorites (
+                code TEXT PRIMARY KEY,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # 迁移旧版 user_state.favorites 中的JSON数组
+        cursor.execute("""
+            INSERT OR IGNORE INTO favorites (code)
+            SELECT json_each.value FROM user_state, json_each(user_state.value)
+            WHERE user_state.key = 'favorites' AND json_valid(user_state.value)
+        """)
+        cursor.execute("DELETE FROM user_state WHERE key = 'favorites'")
+
         # 5. surge_events 表 - 存储急涨事件
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS surge_events (
@@ -101,57 +469,341 @@ def init_database():
             )
         """)
 
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_surge_events_covering
+            ON surge_events(code, start_date DESC, total_gain, is_accelerating)
+        """)
+
+        # 6. uptrend_phases 表 - 同步时预计算的连续上涨阶段
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS uptrend_phases (
+                code TEXT NOT NULL,
+                start_date TEXT NOT NULL,
+                end_date TEXT NOT NULL,
+                duration_days INTEGER NOT NULL,
+                total_gain REAL NOT NULL,
+                max_drawdown REAL NOT NULL,
+                avg_daily_gain REAL NOT NULL,
+                slope_first REAL,
+                slope_second REAL,
+                is_accelerating INTEGER DEFAULT 0,
+                PRIMARY KEY (code, start_date),
+                FOREIGN KEY (code) REFERENCES instrument(code) ON DELETE CASCADE
+            )
+        """)
+
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_uptrend_phases_code_start
+            ON uptrend_phases(code, start_date DESC)
+        """)
+
+        # 记录哪些代码的上涨阶段已按当前数据预计算（没有阶段的代码也有记录）；
+        # 写入时间序列时删除，下次预计算时重新写入
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS uptrend_phases_state (
+                code TEXT PRIMARY KEY,
+                computed_at TIMESTAMP,
+                FOREIGN KEY (code) REFERENCES instrument(code) ON DELETE CASCADE
+            )
+        """)
+
+        # 7. indicators_daily 表 - 同步时预计算的技术指标
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS indicators_daily (
+                code TEXT NOT NULL,
+                date TEXT NOT NULL,
+                days INTEGER NOT NULL,
+                momentum REAL NOT NULL,
+                relative_strength REAL NOT NULL,
+                index_return REAL NOT NULL,
+                volatility REAL NOT NULL,
+                vol_ratio REAL NOT NULL,
+                analysis TEXT NOT NULL,
+                warning_level TEXT NOT NULL,
+                score INTEGER NOT NULL,
+                index_date TEXT,
+                PRIMARY KEY (code, days, date),
+                FOREIGN KEY (code) REFERENCES instrument(code) ON DELETE CASCADE
+            )
+        """)
+
+        # index_date：计算时基准指数的最后日期，指数更新后旧结果不再使用；
+        # 旧库补上该列，已有的行为 NULL，视同过期
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(indicators_daily)")}
+        if "index_date" not in columns:
+            cursor.execute("ALTER TABLE indicators_daily ADD COLUMN index_date TEXT")
+
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_indicators_code_days_date
+            ON indicators_daily(code, days, date DESC)
+        """)
+
         print(f"Database initialized at: {DB_PATH}")
 
 
+def _instrument_row(cursor: sqlite3.Cursor, row: Tuple) -> Dict:
+    """row_factory：直接构造接口返回的 {code, name, type} 字典"""
+    return {"code": row[0], "name": row[1], "type": row[2]}
+
+
 def get_instrument_info(code: str) -> Optional[Dict]:
-    """获取基金/指数信息"""
-    with get_db() as conn:
+    """获取基金/指数信息，返回 {code, name, type}"""
+    with get_db_ro() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM instrument WHERE code = ?", (code,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        cursor.row_factory = _instrument_row
+        cursor.execute(SQL_GET_INSTRUMENT, (code,))
+        return cursor.fetchone()
 
 
 def list_instruments(
     instrument_type: Optional[str] = None
 ) -> List[Dict]:
-    """列出所有基金/指数"""
-    with get_db() as conn:
+    """列出所有基金/指数，每项为 {code, name, type}"""
+    with get_db_ro() as conn:
         cursor = conn.cursor()
+        cursor.row_factory = _instrument_row
         if instrument_type:
-            cursor.execute(
-                "SELECT * FROM instrument WHERE type = ? ORDER BY code",
-                (instrument_type,)
-            )
+            cursor.execute(SQL_LIST_INSTRUMENTS_BY_TYPE, (instrument_type,))
         else:
-            cursor.execute("SELECT * FROM instrument ORDER BY code")
-        return [dict(row) for row in cursor.fetchall()]
+            cursor.execute(SQL_LIST_INSTRUMENTS)
+        return cursor.fetchall()
 
 
-def get_timeseries(
+def list_instrument_codes() -> List[str]:
+    """列出所有基金/指数代码（只查询 code 一列）"""
+    with get_db_ro() as conn:
+        return [row[0] for row in conn.execute(SQL_LIST_INSTRUMENT_CODES)]
+
+
+class TTLCache:
+    """
+    进程内 LRU + TTL 缓存
+
+    净值数据按日更新，短TTL内直接返回缓存结果，写入时按代码主动失效。
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Tuple, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Tuple, value) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, code: str) -> None:
+        """删除某个代码的所有缓存项（key 的第一个元素为代码）"""
+        with self._lock:
+            for key in [k for k in self._data if k[0] == code]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+# 日期范围哨兵值（ISO日期字符串按字典序比较）
+MIN_DATE = "0000-01-01"
+MAX_DATE = "9999-12-31"
+
+# 时间序列查询缓存，key 为 (code, start_date, end_date)
+timeseries_cache = TTLCache(maxsize=1024, ttl=300)
+# 列式数组缓存，key 同上；多个检测器/指标计算读取同一代码时免去重复解析
+timeseries_arrays_cache = TTLCache(maxsize=1024, ttl=300)
+
+
+def invalidate_timeseries(code: str) -> None:
+    """代码数据写入或删除后，使其行缓存和数组缓存一并失效"""
+    timeseries_cache.invalidate(code)
+    timeseries_arrays_cache.invalidate(code)
+
+
+def _next_day(date_str: str) -> Optional[str]:
+    """返回 YYYY-MM-DD 日期的下一天，用作半开区间的上界；不是规范日期时返回 None"""
+    try:
+        day = datetime.strptime(date_str, "%Y-%m-%d")
+    except ValueError:
+        return None
+    if day.strftime("%Y-%m-%d") != date_str:
+        return None
+    return (day + timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def get_timeseries_rows(
     code: str,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None
-) -> List[Dict]:
-    """获取时间序列数据"""
-    with get_db() as conn:
+) -> Tuple[Tuple[str, float], ...]:
+    """
+    获取时间序列数据（带缓存）
+
+    Returns:
+        按日期升序的 (date, value) 元组，结果在调用方之间共享，不可修改
+    """
+    key = (code, start_date, end_date)
+    rows = timeseries_cache.get(key)
+    if rows is not None:
+        return rows
+
+    with get_db_ro() as conn:
         cursor = conn.cursor()
-        query = "SELECT * FROM timeseries_daily WHERE code = ?"
-        params = [code]
+        # 半开区间 [start, end+1)，与索引 (code, date) 的范围扫描一致；
+        # 缺省边界用哨兵值代替，保证始终是同一条语句
+        end_bound = _next_day(end_date) if end_date else MAX_DATE
+        if end_bound is not None:
+            cursor.execute(SQL_GET_TIMESERIES, (code, start_date or MIN_DATE, end_bound))
+        else:
+            cursor.execute(SQL_GET_TIMESERIES_THROUGH, (code, start_date or MIN_DATE, end_date))
+        rows = tuple(tuple(row) for row in cursor.fetchall())
 
-        if start_date:
-            query += " AND date >= ?"
-            params.append(start_date)
+    timeseries_cache.set(key, rows)
+    return rows
 
-        if end_date:
-            query += " AND date <= ?"
-            params.append(end_date)
 
-        query += " ORDER BY date ASC"
+def _unpack_price_blob(dates: str, price_values: bytes) -> Tuple[Tuple[str, ...], np.ndarray]:
+    """把 timeseries_blob 的一行还原为 (日期元组, 只读float64数组)"""
+    return tuple(dates.split("\n")), np.frombuffer(price_values, dtype="<f8")
 
-        cursor.execute(query, params)
-        return [dict(row) for row in cursor.fetchall()]
+
+def get_price_array(code: str) -> Tuple[Tuple[str, ...], np.ndarray]:
+    """
+    获取整段净值序列（连续存储）
+
+    优先读取 timeseries_blob；不存在时从 timeseries_daily 构建并写回。
+    构建在同一个写事务内完成（先删除旧记录取得写锁），期间不会有其他写入插入，
+    写回的序列与明细表一致。
+
+    净值保持 float64：复权净值经分红因子累乘后有效位数超过 float32 的约7位，
+    该数组同时供列式接口直接返回和检测器按阈值判定，降精度会改变返回值和检测结果；
+    单只基金几千个点的序列本身就在CPU缓存内，float32 也省不下内存带宽。
+
+    Returns:
+        (日期元组, 只读float64净值数组)
+    """
+    with get_db_ro() as conn:
+        row = conn.execute(SQL_GET_TIMESERIES_BLOB, (code,)).fetchone()
+    if row is not None:
+        return _unpack_price_blob(row[0], row[1])
+
+    with get_db() as conn:
+        conn.execute(SQL_DELETE_TIMESERIES_BLOB, (code,))
+        rows = conn.execute(SQL_GET_TIMESERIES, (code, MIN_DATE, MAX_DATE)).fetchall()
+        if not rows:
+            return (), np.frombuffer(b"", dtype="<f8")
+        dates = "\n".join(row[0] for row in rows)
+        price_values = np.fromiter(
+            (row[1] for row in rows), dtype="<f8", count=len(rows)
+        ).tobytes()
+        conn.execute(SQL_SAVE_TIMESERIES_BLOB, (code, dates, price_values))
+    return _unpack_price_blob(dates, price_values)
+
+
+def get_timeseries_arrays(
+    code: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+) -> Tuple[Tuple[str, ...], np.ndarray]:
+    """
+    获取列式时间序列数据（带缓存），供指标计算和回测直接使用
+
+    Returns:
+        (日期元组, float64净值数组)，结果在调用方之间共享，数组为只读
+    """
+    key = (code, start_date, end_date)
+    cached = timeseries_arrays_cache.get(key)
+    if cached is not None:
+        return cached
+
+    if start_date is None and end_date is None:
+        # 整段序列直接读取连续存储
+        dates, values = get_price_array(code)
+    else:
+        rows = get_timeseries_rows(code, start_date, end_date)
+        dates = tuple(row[0] for row in rows)
+        values = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+        values.flags.writeable = False
+
+    timeseries_arrays_cache.set(key, (dates, values))
+    return dates, values
+
+
+def get_timeseries_batch(
+    codes: Iterable[str],
+    chunk: int = 500
+) -> Dict[str, Tuple[Tuple[str, ...], np.ndarray]]:
+    """
+    批量获取多个代码的整段列式序列
+
+    已缓存的代码直接复用，其余代码每 chunk 个一批：先用一条 IN 查询取回已有的连续存储
+    (np.frombuffer 直接还原，不逐行解析)，没有连续存储的再从明细表取回；
+    结果写入数组缓存，之后单个代码的 get_timeseries_arrays 也能直接命中
+
+    Returns:
+        {code: (日期元组, 只读float64净值数组)}，没有数据的代码返回空序列
+    """
+    result: Dict[str, Tuple[Tuple[str, ...], np.ndarray]] = {}
+    missing = []
+    for code in dict.fromkeys(codes):
+        cached = timeseries_arrays_cache.get((code, None, None))
+        if cached is not None:
+            result[code] = cached
+        else:
+            missing.append(code)
+
+    with get_db_ro() as conn:
+        for i in range(0, len(missing), chunk):
+            batch = missing[i:i + chunk]
+            sql = SQL_GET_TIMESERIES_BLOB_BATCH.format(placeholders=",".join("?" * len(batch)))
+            for code, dates, price_values in conn.execute(sql, batch):
+                result[code] = _unpack_price_blob(dates, price_values)
+                timeseries_arrays_cache.set((code, None, None), result[code])
+
+            batch = [code for code in batch if code not in result]
+            if not batch:
+                continue
+            sql = SQL_GET_TIMESERIES_BATCH.format(placeholders=",".join("?" * len(batch)))
+            rows = conn.execute(sql, batch).fetchall()
+            for code, code_rows in groupby(rows, key=lambda row: row[0]):
+                code_rows = list(code_rows)
+                values = np.fromiter(
+                    (row[2] for row in code_rows), dtype=np.float64, count=len(code_rows)
+                )
+                values.flags.writeable = False
+                result[code] = (tuple(row[1] for row in code_rows), values)
+                timeseries_arrays_cache.set((code, None, None), result[code])
+
+    empty = np.frombuffer(b"", dtype="<f8")
+    for code in missing:
+        result.setdefault(code, ((), empty))
+    return result
+
+
+def get_timeseries(
+    code: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+) -> List[Dict]:
+    """获取时间序列数据"""
+    return [
+        {"code": code, "date": date, "value": value}
+        for date, value in get_timeseries_rows(code, start_date, end_date)
+    ]
 
 
 def upsert_instrument(
@@ -163,15 +815,7 @@ def upsert_instrument(
     """插入或更新基金/指数信息"""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO instrument (code, name, type, source, updated_at)
-            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(code) DO UPDATE SET
-                name = excluded.name,
-                type = excluded.type,
-                source = excluded.source,
-                updated_at = CURRENT_TIMESTAMP
-        """, (code, name, instrument_type, source))
+        cursor.execute(SQL_UPSERT_INSTRUMENT, (code, name, instrument_type, source))
 
 
 def upsert_timeseries(
@@ -183,13 +827,69 @@ def upsert_timeseries(
     """插入或更新时间序列数据点"""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO timeseries_daily (code, date, value, source_version)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(code, date) DO UPDATE SET
-                value = excluded.value,
-                source_version = excluded.source_version
-        """, (code, date, value, source_version))
+        cursor.execute(SQL_UPSERT_TIMESERIES, (code, date, value, source_version))
+        cursor.execute(SQL_DELETE_TIMESERIES_BLOB, (code,))
+        cursor.execute(SQL_DELETE_UPTREND_PHASES_STATE, (code,))
+        cursor.execute(SQL_DELETE_INDICATORS, (code,))
+    invalidate_timeseries(code)
+
+
+def upsert_timeseries_bulk(
+    rows: Iterable[Tuple[str, str, float, str]],
+    chunk: int = 10000,
+    sync_state: Optional[Tuple[str, Optional[str], str, Optional[str]]] = None
+) -> int:
+    """
+    批量插入或更新时间序列数据（单个事务）
+
+    rows 可以是生成器，按 chunk 大小分批交给 executemany，不会整体物化。
+    外键检查推迟到提交时进行（defer_foreign_keys），避免逐行检查。
+
+    Args:
+        rows: (code, date, value, source_version) 元组序列
+        chunk: 每批 executemany 的行数
+        sync_state: 同步状态 (code, last_success_date, status, message)，
+            给出时与数据在同一事务中写入，同步一次只提交一次
+
+    Returns:
+        写入行数
+    """
+    rows = iter(rows)
+    codes = set()
+    count = 0
+    with get_db() as conn:
+        conn.execute("PRAGMA defer_foreign_keys = ON")
+        while True:
+            batch = list(islice(rows, chunk))
+            if not batch:
+                break
+            conn.executemany(SQL_UPSERT_TIMESERIES, batch)
+            codes.update(row[0] for row in batch)
+            count += len(batch)
+        conn.executemany(SQL_DELETE_TIMESERIES_BLOB, ((code,) for code in codes))
+        conn.executemany(SQL_DELETE_UPTREND_PHASES_STATE, ((code,) for code in codes))
+        conn.executemany(SQL_DELETE_INDICATORS, ((code,) for code in codes))
+        if sync_state is not None:
+            conn.execute(SQL_UPDATE_SYNC_STATE, sync_state)
+    for code in codes:
+        invalidate_timeseries(code)
+    return count
+
+
+def upsert_instrument_bulk(rows: Iterable[Tuple[str, str, str, str]]) -> int:
+    """
+    批量插入或更新基金/指数信息（单个事务）
+
+    Args:
+        rows: (code, name, type, source) 元组序列
+
+    Returns:
+        写入行数
+    """
+    rows = list(rows)
+    with get_db() as conn:
+        conn.executemany(SQL_UPSERT_INSTRUMENT, rows)
+    return len(rows)
 
 
 def update_sync_state(
@@ -201,48 +901,88 @@ def update_sync_state(
     """更新同步状态"""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO sync_state (code, last_success_date, last_sync_at, status, message)
-            VALUES (?, ?, CURRENT_TIMESTAMP, ?, ?)
-            ON CONFLICT(code) DO UPDATE SET
-                last_success_date = excluded.last_success_date,
-                last_sync_at = excluded.last_sync_at,
-                status = excluded.status,
-                message = excluded.message
-        """, (code, last_success_date, status, message))
+        cursor.execute(SQL_UPDATE_SYNC_STATE, (code, last_success_date, status, message))
 
 
 def get_sync_state(code: str) -> Optional[Dict]:
     """获取同步状态"""
-    with get_db() as conn:
+    with get_db_ro() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM sync_state WHERE code = ?", (code,))
+        cursor.execute(SQL_GET_SYNC_STATE, (code,))
         row = cursor.fetchone()
         return dict(row) if row else None
 
 
+def get_data_version(code: Optional[str] = None) -> str:
+    """
+    获取数据版本标识，用于生成 HTTP ETag
+
+    Args:
+        code: 基金/指数代码；为空时返回基金列表整体的版本
+
+    Returns:
+        版本字符串，数据发生变化（增删、更新信息、同步）后随之改变
+    """
+    with get_db_ro() as conn:
+        if code is None:
+            row = conn.execute(SQL_GET_INSTRUMENTS_VERSION).fetchone()
+        else:
+            row = conn.execute(SQL_GET_DATA_VERSION, (code,)).fetchone()
+        return "|".join(str(v) for v in row) if row else ""
+
+
 def save_user_state(key: str, value: str) -> None:
     """保存用户状态"""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO user_state (key, value, updated_at)
-            VALUES (?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(key) DO UPDATE SET
-                value = excluded.value,
-                updated_at = CURRENT_TIMESTAMP
-        """, (key, value))
+        cursor.execute(SQL_SAVE_USER_STATE, (key, value))
 
 
 def load_user_state(key: str) -> Optional[str]:
     """加载用户状态"""
-    with get_db() as conn:
+    with get_db_ro() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT value FROM user_state WHERE key = ?", (key,))
+        cursor.execute(SQL_LOAD_USER_STATE, (key,))
         row = cursor.fetchone()
         return row["value"] if row else None
 
 
+def list_favorites() -> List[str]:
+    """获取收藏代码列表（按添加顺序）"""
+    with get_db_ro() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SQL_LIST_FAVORITES)
+        return [row["code"] for row in cursor.fetchall()]
+
+
+def add_favorites(codes: List[str]) -> None:
+    """追加收藏，已存在的代码保持原顺序"""
+    with get_db() as conn:
+        conn.executemany(
+            SQL_ADD_FAVORITE,
+            [(code,) for code in codes]
+        )
+
+
+def remove_favorites(codes: List[str]) -> None:
+    """移除收藏"""
+    with get_db() as conn:
+        conn.executemany(
+            SQL_REMOVE_FAVORITE,
+            [(code,) for code in codes]
+        )
+
+
+def replace_favorites(codes: List[str]) -> None:
+    """用给定列表替换全部收藏"""
+    with get_db() as conn:
+        conn.execute("DELETE FROM favorites")
+        conn.executemany(
+            SQL_ADD_FAVORITE,
+            [(code,) for code in codes]
+        )
+
+
 def delete_instrument(code: str) -> Dict:
     """
     删除基金/指数及其所有关联数据
@@ -259,14 +999,16 @@ def delete_instrument(code: str) -> Dict:
         cursor = conn.cursor()
 
         # 删除主表记录，外键约束会自动级联删除关联数据
-        cursor.execute("DELETE FROM instrument WHERE code = ?", (code,))
+        cursor.execute(SQL_DELETE_INSTRUMENT, (code,))
         instrument_deleted = cursor.rowcount
 
-        return {
-            "code": code,
-            "instrument_deleted": instrument_deleted,
-            "message": "关联数据通过外键约束自动删除"
-        }
+    invalidate_timeseries(code)
+
+    return {
+        "code": code,
+        "instrument_deleted": instrument_deleted,
+        "message": "关联数据通过外键约束自动删除"
+    }
 
 
 def save_surge_event(
@@ -282,20 +1024,37 @@ def save_surge_event(
     """保存急涨事件"""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT OR REPLACE INTO surge_events 
-            (code, start_date, end_date, window, total_gain, slope_first, slope_second, is_accelerating)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (code, start_date, end_date, window, total_gain, slope_first, slope_second, 1 if is_accelerating else 0))
+        cursor.execute(SQL_SAVE_SURGE_EVENT, (code, start_date, end_date, window, total_gain, slope_first, slope_second, 1 if is_accelerating else 0))
+
+
+def save_surge_events_bulk(rows: Iterable[Tuple], replace_all: bool = False) -> int:
+    """
+    批量保存急涨事件（单个事务）
+
+    Args:
+        rows: (code, start_date, end_date, window, total_gain,
+               slope_first, slope_second, is_accelerating) 元组序列
+        replace_all: 写入前清空所有旧事件（同一事务内完成，读取方不会看到空表）
+
+    Returns:
+        写入行数
+    """
+    rows = [
+        (*row[:7], 1 if row[7] else 0)
+        for row in rows
+    ]
+    with get_db() as conn:
+        if replace_all:
+            conn.execute(SQL_CLEAR_SURGE_EVENTS)
+        conn.executemany(SQL_SAVE_SURGE_EVENT, rows)
+    return len(rows)
 
 
 def get_surge_events(code: str) -> List[Dict]:
     """获取某只基金的急涨事件"""
-    with get_db() as conn:
+    with get_db_ro() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT * FROM surge_events WHERE code = ? ORDER BY start_date DESC
-        """, (code,))
+        cursor.execute(SQL_GET_SURGE_EVENTS, (code,))
         return [dict(row) for row in cursor.fetchall()]
 
 
@@ -303,7 +1062,103 @@ def clear_surge_events() -> None:
     """清空所有急涨事件"""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM surge_events")
+        cursor.execute(SQL_CLEAR_SURGE_EVENTS)
+
+
+def save_uptrend_phases(code: str, rows: Iterable[Tuple]) -> int:
+    """
+    替换某只基金的预计算上涨阶段，并标记该代码已预计算（单个事务）
+
+    Args:
+        code: 基金/指数代码
+        rows: (start_date, end_date, duration_days, total_gain, max_drawdown,
+               avg_daily_gain, slope_first, slope_second, is_accelerating) 元组序列；
+               total_gain 为未取整的涨幅%，查询时按它过滤，与实时检测的判断一致
+
+    Returns:
+        写入行数
+    """
+    rows = [
+        (code, *row[:8], 1 if row[8] else 0)
+        for row in rows
+    ]
+    with get_db() as conn:
+        conn.execute(SQL_DELETE_UPTREND_PHASES, (code,))
+        conn.executemany(SQL_INSERT_UPTREND_PHASE, rows)
+        conn.execute(SQL_MARK_UPTREND_PHASES, (code,))
+    return len(rows)
+
+
+def get_uptrend_phases(
+    code: str,
+    min_gain: float = 0,
+    min_duration: int = 0
+) -> Optional[List[Dict]]:
+    """
+    获取预计算的上涨阶段（按开始日期升序）
+
+    Returns:
+        阶段列表，涨幅按实时检测的方式取两位小数；
+        该代码尚未按当前数据预计算时返回 None（已预计算但没有符合条件的阶段时返回空列表）
+    """
+    with get_db_ro() as conn:
+        if conn.execute(SQL_HAS_UPTREND_PHASES, (code,)).fetchone() is None:
+            return None
+        cursor = conn.cursor()
+        cursor.execute(SQL_GET_UPTREND_PHASES, (code, min_gain, min_duration))
+        return [
+            {
+                **dict(row),
+                # 与 UptrendPhaseDetector 对 np.float64 涨幅的取整方式一致
+                "total_gain": round(np.float64(row["total_gain"]), 2),
+                "is_accelerating": bool(row["is_accelerating"])
+            }
+            for row in cursor.fetchall()
+        ]
+
+
+def save_indicators(code: str, date: str, days: int, result: Dict, index_date: str) -> None:
+    """保存某日的技术指标计算结果，index_date 为计算所用基准指数数据的最后日期"""
+    with get_db() as conn:
+        conn.execute(SQL_SAVE_INDICATORS, (
+            code, date, days,
+            result["momentum"],
+            result["relative_strength"],
+            result["index_return"],
+            result["volatility"],
+            result["vol_ratio"],
+            json.dumps(result["analysis"], ensure_ascii=False),
+            result["warning_level"],
+            result["score"],
+            index_date
+        ))
+
+
+def get_latest_indicators(code: str, days: int, index_date: str) -> Optional[Dict]:
+    """
+    获取最近一次预计算的技术指标，格式与 IndicatorService.calculate_indicators(...).to_dict() 一致
+
+    基金自身数据写入时预计算结果随之删除；相对强度等依赖基准指数，
+    计算时的指数最后日期与 index_date（当前指数数据）不同时结果已过期，返回 None
+    """
+    with get_db_ro() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SQL_GET_LATEST_INDICATORS, (code, days))
+        row = cursor.fetchone()
+        if not row or row["index_date"] != index_date:
+            return None
+        return {
+            "fund_code": row["code"],
+            "period_days": row["days"],
+            "momentum": row["momentum"],
+            "relative_strength": row["relative_strength"],
+            "index_return": row["index_return"],
+            "volatility": row["volatility"],
+            "vol_ratio": row["vol_ratio"],
+            "analysis": json.loads(row["analysis"]),
+            "warning_level": row["warning_level"],
+            "score": row["score"]
+        }
 
 
 if __name__ == "__main__":
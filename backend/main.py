@@ -7,35 +7,57 @@ FastAPI后端主应用
 2. 后台异步同步外部数据（AKShare）
 3. 所有查询操作快速返回，不调用外部API
 """
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel
-from typing import List, Optional, Dict
-from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Dict
+from datetime import date, datetime, timedelta
+from collections import defaultdict, deque
 import asyncio
+import hashlib
+import time
 
 from database import (
     init_database,
+    warm_pools,
+    close_pool,
+    optimize_database,
     get_instrument_info,
     list_instruments,
-    get_timeseries,
+    get_timeseries_rows,
+    get_timeseries_arrays,
     upsert_instrument,
+    upsert_instrument_bulk,
     delete_instrument,
     save_user_state,
     load_user_state,
     get_sync_state,
-    get_surge_events
+    get_data_version,
+    list_favorites,
+    add_favorites,
+    remove_favorites,
+    replace_favorites,
+    get_surge_events,
+    get_latest_indicators,
+    get_uptrend_phases as get_precomputed_uptrend_phases
 )
 from services.data_fetcher import DataFetcher
 from services.sync_service import sync_service
 from services.indicators import indicator_service
-from services.backtester import UptrendPhaseDetector
+from services.backtester import (
+    UptrendPhaseDetector,
+    PRECOMPUTED_MAX_DRAWDOWN,
+    PRECOMPUTED_MIN_GAIN,
+    PRECOMPUTED_MIN_DURATION
+)
 
 
 app = FastAPI(
     title="Fund Trend Lab API",
     description="基金多时间区间趋势可视化工具 - 后端API",
-    version="1.1.0"
+    version="1.1.0",
+    default_response_class=ORJSONResponse
 )
 
 # 添加CORS支持（允许前端跨域访问）
@@ -47,12 +69,85 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 各接口最近请求耗时（毫秒），用于统计 p50/p99
+request_latencies: Dict[str, deque] = defaultdict(lambda: deque(maxlen=1000))
+
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    """记录每个接口的处理耗时"""
+    start = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        # 未匹配路由的请求（如各种 404 地址）统一归到一个键下，避免键数量随 URL 无限增长
+        route = request.scope.get("route")
+        path = route.path if route is not None else "<unmatched>"
+        request_latencies[f"{request.method} {path}"].append(
+            (time.perf_counter() - start) * 1000
+        )
+
+
+@app.exception_handler(Exception)
+async def unhandled_exception_handler(request: Request, exc: Exception):
+    """统一处理未捕获异常，返回500"""
+    return ORJSONResponse({"detail": str(exc)}, status_code=500)
+
+
+def _cached_response(
+    request: Request,
+    version: str,
+    build: Callable[[], Response]
+) -> Response:
+    """
+    带 ETag 的条件响应
+
+    ETag 由请求URL、数据版本和当天日期生成（按天数范围查询的起止日期随日期变化），
+    客户端携带相同的 If-None-Match 时直接返回 304，跳过查询和序列化
+    """
+    etag = '"' + hashlib.blake2b(
+        f"{request.url}|{version}|{date.today()}".encode(),
+        digest_size=8
+    ).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    response = build()
+    response.headers.update(headers)
+    return response
+
+
+# 数据库维护间隔（秒）
+DB_MAINTENANCE_INTERVAL = 600
+
+
+async def database_maintenance_task():
+    """定期执行 PRAGMA optimize 和 WAL checkpoint"""
+    while True:
+        await asyncio.sleep(DB_MAINTENANCE_INTERVAL)
+        try:
+            await asyncio.to_thread(optimize_database)
+        except Exception as e:
+            print(f"Database maintenance error: {e}")
+
+
 # 启动时初始化数据库
 @app.on_event("startup")
 async def startup_event():
     """应用启动时初始化数据库"""
     init_database()
+    warm_pools()
     print("Database initialized.")
+    app.state.maintenance_task = asyncio.create_task(database_maintenance_task())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时停止维护任务并释放数据库连接池"""
+    app.state.maintenance_task.cancel()
+    close_pool()
 
 
 # ==================== Pydantic模型 ====================
@@ -75,6 +170,7 @@ class TimeseriesRequest(BaseModel):
     code: str
     start_date: Optional[str] = None
     end_date: Optional[str] = None
+    columnar: bool = False  # True 时返回 {dates, values} 列式结构
 
 
 class SyncRequest(BaseModel):
@@ -104,7 +200,10 @@ class FavoritesRequest(BaseModel):
 # ==================== 基金/指数管理 ====================
 
 @app.get("/api/instruments")
-async def get_instruments(instrument_type: Optional[str] = None) -> List[Instrument]:
+async def get_instruments(
+    request: Request,
+    instrument_type: Optional[str] = None
+) -> Response:
     """
     获取所有基金/指数列表
 
@@ -114,22 +213,14 @@ async def get_instruments(instrument_type: Optional[str] = None) -> List[Instrum
     Returns:
         基金/指数列表
     """
-    try:
-        instruments = list_instruments(instrument_type)
-        return [
-            Instrument(
-                code=inst["code"],
-                name=inst["name"],
-                type=inst["type"]
-            )
-            for inst in instruments
-        ]
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    def build() -> ORJSONResponse:
+        return ORJSONResponse(list_instruments(instrument_type))
+
+    return _cached_response(request, get_data_version(), build)
 
 
 @app.get("/api/instruments/{code}")
-async def get_instrument_detail(code: str) -> Instrument:
+async def get_instrument_detail(request: Request, code: str) -> Response:
     """
     获取单个基金/指数详情
 
@@ -142,7 +233,7 @@ async def get_instrument_detail(code: str) -> Instrument:
     Raises:
         404: 基金/指数不存在
     """
-    try:
+    def build() -> ORJSONResponse:
         info = get_instrument_info(code)
 
         if not info:
@@ -151,15 +242,9 @@ async def get_instrument_detail(code: str) -> Instrument:
                 detail=f"Instrument {code} not found. Please add it first via /api/funds/batch"
             )
 
-        return Instrument(
-            code=info["code"],
-            name=info["name"],
-            type=info["type"]
-        )
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return ORJSONResponse(info)
+
+    return _cached_response(request, get_data_version(code), build)
 
 
 @app.get("/api/indicators/{code}")
@@ -178,11 +263,11 @@ async def get_indicators(code: str, days: int = 20) -> Dict:
         code: 基金代码
         days: 计算周期天数（默认20）
     """
-    try:
-        result = indicator_service.calculate_indicators(code, days)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # 优先读取同步时预计算的结果（基准指数更新后的旧结果不使用）
+    result = get_latest_indicators(code, days, indicator_service.current_index_date())
+    if result is None:
+        result = indicator_service.calculate_indicators(code, days).to_dict()
+    return result
 
 
 @app.get("/api/surge_events/{code}")
@@ -192,11 +277,8 @@ async def get_surge_events_api(code: str) -> List[Dict]:
     
     用于在图表上标注急涨区间
     """
-    try:
-        events = get_surge_events(code)
-        return events
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    events = get_surge_events(code)
+    return events
 
 
 @app.get("/api/uptrend_phases/{code}")
@@ -205,7 +287,7 @@ async def get_uptrend_phases(
     max_drawdown: float = 5.0,
     min_gain: float = 10.0,
     min_duration: int = 5
-) -> List[Dict]:
+) -> ORJSONResponse:
     """
     获取基金的连续上涨阶段
     
@@ -221,34 +303,39 @@ async def get_uptrend_phases(
     Returns:
         上涨阶段列表
     """
-    try:
-        info = get_instrument_info(code)
-        name = info["name"] if info else ""
-        
-        detector = UptrendPhaseDetector(
-            max_drawdown_tolerance=max_drawdown,
-            min_gain=min_gain,
-            min_duration=min_duration
-        )
-        
-        phases = detector.detect_phases(code, name)
-        
-        return [
-            {
-                "start_date": p.start_date,
-                "end_date": p.end_date,
-                "duration_days": p.duration_days,
-                "total_gain": p.total_gain,
-                "max_drawdown": p.max_drawdown,
-                "avg_daily_gain": p.avg_daily_gain,
-                "slope_first": p.slope_first,
-                "slope_second": p.slope_second,
-                "is_accelerating": p.is_accelerating,
-            }
-            for p in phases
-        ]
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # 默认回撤阈值下直接读取同步时预计算的结果
+    if (max_drawdown == PRECOMPUTED_MAX_DRAWDOWN and
+            min_gain >= PRECOMPUTED_MIN_GAIN and
+            min_duration >= PRECOMPUTED_MIN_DURATION):
+        phases = get_precomputed_uptrend_phases(code, min_gain, min_duration)
+        if phases is not None:  # 已预计算时空列表也直接返回
+            return ORJSONResponse(phases)
+
+    info = get_instrument_info(code)
+    name = info["name"] if info else ""
+    
+    detector = UptrendPhaseDetector(
+        max_drawdown_tolerance=max_drawdown,
+        min_gain=min_gain,
+        min_duration=min_duration
+    )
+    
+    phases = detector.detect_phases(code, name)
+    
+    return ORJSONResponse([
+        {
+            "start_date": p.start_date,
+            "end_date": p.end_date,
+            "duration_days": p.duration_days,
+            "total_gain": p.total_gain,
+            "max_drawdown": p.max_drawdown,
+            "avg_daily_gain": p.avg_daily_gain,
+            "slope_first": p.slope_first,
+            "slope_second": p.slope_second,
+            "is_accelerating": p.is_accelerating,
+        }
+        for p in phases
+    ])
 
 
 @app.post("/api/instruments")
@@ -262,19 +349,16 @@ async def add_instrument(instrument: Instrument) -> Dict:
     Returns:
         操作结果
     """
-    try:
-        upsert_instrument(
-            code=instrument.code,
-            name=instrument.name,
-            instrument_type=instrument.type
-        )
+    upsert_instrument(
+        code=instrument.code,
+        name=instrument.name,
+        instrument_type=instrument.type
+    )
 
-        return {
-            "success": True,
-            "message": f"Instrument {instrument.code} added successfully"
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "success": True,
+        "message": f"Instrument {instrument.code} added successfully"
+    }
 
 
 @app.delete("/api/instruments/{code}")
@@ -288,33 +372,49 @@ async def remove_instrument(code: str) -> Dict:
     Returns:
         删除结果
     """
-    try:
-        # 检查基金是否存在
-        info = get_instrument_info(code)
-        if not info:
-            raise HTTPException(status_code=404, detail=f"Instrument {code} not found")
-
-        # 执行删除
-        result = delete_instrument(code)
+    # 执行删除，以删除行数判断基金是否存在
+    result = delete_instrument(code)
 
-        if result["instrument_deleted"] == 0:
-            raise HTTPException(status_code=404, detail=f"Instrument {code} not found")
+    if result["instrument_deleted"] == 0:
+        raise HTTPException(status_code=404, detail=f"Instrument {code} not found")
 
-        return {
-            "success": True,
-            "message": f"Instrument {code} deleted successfully",
-            "details": result
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "success": True,
+        "message": f"Instrument {code} deleted successfully",
+        "details": result
+    }
 
 
 # ==================== 时间序列数据 ====================
 
+def _timeseries_response(
+    code: str,
+    start_date: Optional[str],
+    end_date: Optional[str],
+    columnar: bool
+) -> ORJSONResponse:
+    """
+    构造时间序列响应
+
+    列式格式直接把 numpy 数组交给 orjson 序列化，不再逐点构造字典
+    """
+    if columnar:
+        dates, values = get_timeseries_arrays(code, start_date, end_date)
+        return ORJSONResponse({"dates": dates, "values": values})
+
+    rows = get_timeseries_rows(code, start_date, end_date)
+
+    return ORJSONResponse([
+        {
+            "date": date,
+            "value": value
+        }
+        for date, value in rows
+    ])
+
+
 @app.post("/api/timeseries")
-async def get_timeseries_data(request: TimeseriesRequest) -> List[Dict]:
+async def get_timeseries_data(request: TimeseriesRequest) -> ORJSONResponse:
     """
     获取时间序列数据
 
@@ -322,32 +422,24 @@ async def get_timeseries_data(request: TimeseriesRequest) -> List[Dict]:
         request: 包含code、start_date、end_date的请求
 
     Returns:
-        时间序列数据列表 [{date, value}]
+        时间序列数据列表 [{date, value}]，columnar=True 时为 {dates, values}
     """
-    try:
-        data = get_timeseries(
-            code=request.code,
-            start_date=request.start_date,
-            end_date=request.end_date
-        )
-
-        return [
-            {
-                "date": item["date"],
-                "value": item["value"]
-            }
-            for item in data
-        ]
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return _timeseries_response(
+        code=request.code,
+        start_date=request.start_date,
+        end_date=request.end_date,
+        columnar=request.columnar
+    )
 
 
 @app.get("/api/timeseries/{code}/range/{days}")
 async def get_timeseries_by_range(
+    request: Request,
     code: str,
     days: int,
-    end_date: Optional[str] = None
-) -> List[Dict]:
+    end_date: Optional[str] = None,
+    columnar: bool = False
+) -> Response:
     """
     按天数范围获取时间序列数据
 
@@ -355,27 +447,21 @@ async def get_timeseries_by_range(
         code: 基金/指数代码
         days: 天数（如365表示1年）
         end_date: 结束日期，默认为今天
+        columnar: 是否返回 {dates, values} 列式结构
 
     Returns:
         时间序列数据列表
     """
-    try:
-        if not end_date:
-            end_date = datetime.now().strftime("%Y-%m-%d")
+    if not end_date:
+        end_date = datetime.now().strftime("%Y-%m-%d")
 
-        start_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    start_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
 
-        data = get_timeseries(code, start_date, end_date)
-
-        return [
-            {
-                "date": item["date"],
-                "value": item["value"]
-            }
-            for item in data
-        ]
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return _cached_response(
+        request,
+        get_data_version(code),
+        lambda: _timeseries_response(code, start_date, end_date, columnar)
+    )
 
 
 # ==================== 数据同步 ====================
@@ -392,21 +478,22 @@ async def sync_instruments(request: SyncRequest, background_tasks: BackgroundTas
     Returns:
         同步任务信息
     """
-    try:
-        # 启动后台同步任务
-        async def sync_task():
-            results = await sync_service.sync_multiple(request.codes)
-            print(f"Sync completed: {len([r for r in results if r['success']])}/{len(results)} succeeded")
+    # 启动后台同步任务
+    async def sync_task():
+        # 边完成边计数，不保留每个代码的结果
+        success_count = total = 0
+        async for result in sync_service.sync_multiple_iter(request.codes):
+            total += 1
+            success_count += result["success"]
+        print(f"Sync completed: {success_count}/{total} succeeded")
 
-        background_tasks.add_task(sync_task)
+    background_tasks.add_task(sync_task)
 
-        return {
-            "success": True,
-            "message": f"Sync task started for {len(request.codes)} instruments",
-            "codes": request.codes
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "success": True,
+        "message": f"Sync task started for {len(request.codes)} instruments",
+        "codes": request.codes
+    }
 
 
 @app.get("/api/sync/status/{code}")
@@ -420,25 +507,22 @@ async def get_sync_status(code: str) -> Dict:
     Returns:
         同步状态信息
     """
-    try:
-        status = get_sync_state(code)
-        if not status:
-            return {
-                "code": code,
-                "synced": False,
-                "message": "Not synced yet"
-            }
-
+    status = get_sync_state(code)
+    if not status:
         return {
             "code": code,
-            "synced": True,
-            "last_success_date": status["last_success_date"],
-            "last_sync_at": status["last_sync_at"],
-            "status": status["status"],
-            "message": status["message"]
+            "synced": False,
+            "message": "Not synced yet"
         }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "code": code,
+        "synced": True,
+        "last_success_date": status["last_success_date"],
+        "last_sync_at": status["last_sync_at"],
+        "status": status["status"],
+        "message": status["message"]
+    }
 
 
 @app.get("/api/sync/syncing")
@@ -465,11 +549,8 @@ async def save_state(state: UserState) -> Dict:
     Returns:
         操作结果
     """
-    try:
-        save_user_state(state.key, state.value)
-        return {"success": True}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    save_user_state(state.key, state.value)
+    return {"success": True}
 
 
 @app.get("/api/state/{key}")
@@ -483,16 +564,11 @@ async def load_state(key: str) -> Dict:
     Returns:
         状态值
     """
-    try:
-        value = load_user_state(key)
-        if value is None:
-            raise HTTPException(status_code=404, detail=f"State {key} not found")
+    value = load_user_state(key)
+    if value is None:
+        raise HTTPException(status_code=404, detail=f"State {key} not found")
 
-        return {"key": key, "value": value}
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return {"key": key, "value": value}
 
 
 # ==================== 批量基金管理 ====================
@@ -511,58 +587,62 @@ async def batch_add_funds(
     Returns:
         添加结果统计
     """
-    import json
-    
     results = []
     errors = []
-    added_count = 0
-    synced_count = 0
+    rows = []
     
     fetcher = DataFetcher()
     
-    for code in request.codes:
-        try:
-            # 获取基金信息
-            info = fetcher.get_fund_info(code)
-
-            # 如果无法获取基金信息，记录错误并跳过
-            if not info:
-                errors.append({
-                    "code": code,
-                    "error": "无法获取基金信息，请确认基金代码正确"
-                })
-                continue
-
-            name = info.get('name', f'基金{code}')
-            fund_type = 'fund'
-
-            # 添加到数据库
-            upsert_instrument(code, name, fund_type, source='akshare')
-            added_count += 1
-            results.append({
+    # 并发获取基金信息（相互独立的网络请求）
+    infos = await asyncio.gather(
+        *[asyncio.to_thread(fetcher.get_fund_info, code) for code in request.codes],
+        return_exceptions=True
+    )
+    
+    for code, info in zip(request.codes, infos):
+        if isinstance(info, Exception):
+            errors.append({
                 "code": code,
-                "name": name,
-                "status": "added"
+                "error": str(info)
             })
+            continue
 
-            # 异步同步数据
-            if request.sync_data:
-                background_tasks.add_task(sync_service.sync_single, code)
-                synced_count += 1
-
-        except Exception as e:
+        # 如果无法获取基金信息，记录错误并跳过
+        if not info:
             errors.append({
                 "code": code,
-                "error": str(e)
+                "error": "无法获取基金信息，请确认基金代码正确"
             })
+            continue
+
+        name = info.get('name', f'基金{code}')
+        rows.append((code, name, 'fund', 'akshare'))
+        results.append({
+            "code": code,
+            "name": name,
+            "status": "added"
+        })
+    
+    # 单个事务写入所有基金
+    added_codes = [row[0] for row in rows]
+    try:
+        added_count = upsert_instrument_bulk(rows)
+    except Exception as e:
+        errors.extend({"code": code, "error": str(e)} for code in added_codes)
+        results = []
+        added_codes = []
+        added_count = 0
+    
+    # 异步同步数据（一次性提交，由同步服务统一调度）
+    synced_count = 0
+    if request.sync_data and added_codes:
+        background_tasks.add_task(sync_service.sync_multiple, added_codes)
+        synced_count = len(added_codes)
     
     # 处理收藏
     favorites_updated = 0
     if request.set_favorite:
-        existing = load_user_state("favorites")
-        existing_list = json.loads(existing) if existing else []
-        new_favorites = list(set(existing_list + request.codes))
-        save_user_state("favorites", json.dumps(new_favorites))
+        add_favorites(request.codes)
         favorites_updated = len(request.codes)
     
     return {
@@ -585,10 +665,7 @@ async def get_favorites() -> Dict:
     Returns:
         收藏的基金代码列表
     """
-    import json
-    
-    favorites_str = load_user_state("favorites")
-    favorites = json.loads(favorites_str) if favorites_str else []
+    favorites = list_favorites()
     
     return {
         "count": len(favorites),
@@ -609,21 +686,16 @@ async def set_favorites(request: FavoritesRequest) -> Dict:
     Returns:
         更新后的收藏列表
     """
-    import json
-    
-    existing_str = load_user_state("favorites")
-    existing = json.loads(existing_str) if existing_str else []
-    
     if request.mode == "replace":
-        new_favorites = request.codes
+        replace_favorites(request.codes)
     elif request.mode == "add":
-        new_favorites = list(set(existing + request.codes))
+        add_favorites(request.codes)
     elif request.mode == "remove":
-        new_favorites = [c for c in existing if c not in request.codes]
+        remove_favorites(request.codes)
     else:
         raise HTTPException(status_code=400, detail=f"Invalid mode: {request.mode}")
     
-    save_user_state("favorites", json.dumps(new_favorites))
+    new_favorites = list_favorites()
     
     return {
         "success": True,
@@ -636,12 +708,28 @@ async def set_favorites(request: FavoritesRequest) -> Dict:
 # ==================== 健康检查 ====================
 
 @app.get("/api/health")
-async def health_check():
-    """健康检查接口"""
-    return {
+async def health_check() -> ORJSONResponse:
+    """健康检查接口（datetime 交给 orjson 原生序列化）"""
+    return ORJSONResponse({
         "status": "healthy",
-        "timestamp": datetime.now().isoformat()
-    }
+        "timestamp": datetime.now()
+    })
+
+
+@app.get("/api/metrics/latency")
+async def get_latency_metrics() -> Dict:
+    """各接口最近请求耗时统计（毫秒）"""
+    metrics = {}
+    for endpoint, samples in list(request_latencies.items()):
+        ordered = sorted(samples)
+        if not ordered:
+            continue
+        metrics[endpoint] = {
+            "count": len(ordered),
+            "p50": round(ordered[len(ordered) // 2], 3),
+            "p99": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 3),
+        }
+    return metrics
 
 
 if __name__ == "__main__":
@@ -0,0 +1,295 @@
+"""
+AKShare 数据本地磁盘缓存与扫描流程
+供扫描脚本共用，避免每次运行都重新拉取全量基金列表和各基金净值历史，
+并记录每只基金的扫描结论，净值未更新时直接复用；
+各脚本只提供自己的筛选函数和输出格式，获取、缓存、记录流程由 run_cached_scan 统一完成
+"""
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import akshare as ak
+import numpy as np
+import orjson
+import pandas as pd
+import requests
+from akshare.fund import fund_em
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 缓存目录与有效期
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'fund_trend_lab')
+FUND_LIST_TTL = 86400  # 基金列表缓存有效期（秒）
+FUND_NAV_TTL = 86400   # 单只基金净值历史缓存有效期（秒），净值每日更新一次
+FETCH_WORKERS = 32     # 扫描脚本获取净值的并发线程数（纯网络 I/O）
+SCAN_CHUNK = 256       # 每获取这么多只基金的净值就批量检测一次，记录命中结果并保存结论缓存
+
+# 只看股票型、混合型、指数型基金（预编译匹配模式）
+STOCK_TYPES = ['股票型', '混合型', '股票指数', '联接基金']
+STOCK_TYPE_PATTERN = re.compile('|'.join(map(re.escape, STOCK_TYPES)))
+
+
+class _ThreadLocalSessions:
+    """
+    按线程分配 requests.Session，替代 fund_em 模块引用的 requests
+
+    fund_em 只调用 requests.get；每个线程各用自己的 Session，保持连接复用，
+    同时避免多个线程共用一个 Session 的 cookie 和连接池状态
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(max_retries=Retry(total=2, backoff_factor=0.3))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def get(self, url, **kwargs):
+        return self._session().get(url, **kwargs)
+
+    def close(self) -> None:
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions.clear()
+
+
+@contextmanager
+def pooled_fund_requests():
+    """
+    在 with 块内让 AKShare 基金接口复用 HTTP 连接
+
+    fund_em 模块内部直接调用 requests.get，每次请求都新建 TCP+TLS 连接；
+    块内把该模块引用的 requests 换成按线程分配的 Session，退出时恢复并关闭连接
+    """
+    sessions = _ThreadLocalSessions()
+    original = fund_em.requests
+    fund_em.requests = sessions
+    try:
+        yield
+    finally:
+        fund_em.requests = original
+        sessions.close()
+
+
+def _frame_path(name: str) -> str:
+    return os.path.join(CACHE_DIR, f'{name}.pkl')
+
+
+def _cached_frame(name: str, loader: Callable[[], pd.DataFrame], ttl: float) -> pd.DataFrame:
+    """读取未过期的缓存 DataFrame，过期或不存在时调用 loader 重新获取并写入缓存"""
+    path = _frame_path(name)
+    try:
+        if time.time() - os.path.getmtime(path) < ttl:
+            return pd.read_pickle(path)
+    except (OSError, ValueError):
+        pass
+
+    df = loader()
+    if df is not None and len(df) > 0:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再替换，避免并发读取到半截文件
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+    return df
+
+
+def _load_fund_list() -> pd.DataFrame:
+    """获取全部公募基金列表（ak.fund_name_em），24小时内复用磁盘缓存"""
+    return _cached_frame('fund_name_em', ak.fund_name_em, FUND_LIST_TTL)
+
+
+def _load_fund_nav(code: str) -> pd.DataFrame:
+    """获取单只基金的单位净值走势（AKShare 总是返回全量历史），24小时内复用磁盘缓存"""
+    return _cached_frame(
+        os.path.join('nav', code),
+        lambda: ak.fund_open_fund_info_em(symbol=code, indicator="单位净值走势"),
+        FUND_NAV_TTL,
+    )
+
+
+def _load_scan_cache(name: str, params: Dict) -> Dict:
+    """
+    读取扫描结论缓存 {code: [净值区间, 结论]}，净值区间见 _nav_key
+
+    扫描参数与上次不同时结论全部作废，返回空字典
+    """
+    try:
+        with open(os.path.join(CACHE_DIR, f'{name}.json'), 'rb') as f:
+            data = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+    return data['entries'] if data.get('params') == params else {}
+
+
+def _save_scan_cache(name: str, params: Dict, entries: Dict) -> None:
+    """保存扫描结论缓存"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, f'{name}.json')
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps({'params': params, 'entries': entries}))
+    os.replace(tmp_path, path)
+
+
+def get_fund_data(code: str, days: int = 365) -> Tuple[np.ndarray, np.ndarray]:
+    """获取基金最近 days 天的净值数据，返回 (日期数组, 净值数组)，获取失败时为空数组"""
+    empty = (np.empty(0, dtype='U10'), np.empty(0, dtype=np.float64))
+    try:
+        df = _load_fund_nav(code)
+        if df is None or len(df) == 0:
+            return empty
+
+        # 按列整体转换，兼容 YYYYMMDD 格式的日期
+        dates = df['净值日期'].astype(str)
+        compact = ~dates.str.contains('-', regex=False)
+        if compact.any():
+            dates = dates.where(~compact, dates.str[:4] + '-' + dates.str[4:6] + '-' + dates.str[6:])
+        dates = dates.to_numpy(dtype=str)
+        values = df['单位净值'].to_numpy(dtype=np.float64)
+
+        # 只取最近N天
+        start_str = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+        mask = dates >= start_str
+        return dates[mask], values[mask]
+    except Exception:
+        return empty
+
+
+def _nav_key(dates: np.ndarray) -> Optional[str]:
+    """
+    扫描所用净值区间的标识 "首日~末日"，没有数据时为 None
+
+    历史净值不会变化，首末日期相同时参与检测的数据就相同，上次的结论可以直接复用；
+    净值每日更新或窗口起点随日期后移时标识随之改变
+    """
+    if len(dates) == 0:
+        return None
+    return f"{dates[0]}~{dates[-1]}"
+
+
+def _load_equity_funds() -> List[Tuple[str, str]]:
+    """全部权益类（股票型、混合型、指数型）基金的 (代码, 简称) 列表"""
+    df = _load_fund_list()
+    mask = df['基金类型'].str.contains(STOCK_TYPE_PATTERN, na=False)
+    return list(zip(df.loc[mask, '基金代码'].to_numpy(), df.loc[mask, '基金简称'].to_numpy()))
+
+
+def run_cached_scan(
+    funds: List[Tuple[str, str]],
+    scan_funds: Callable[[List], List[Optional[Dict]]],
+    cache_name: str,
+    params: Dict,
+    stream_file: str,
+    recent_days: int,
+    on_hit: Optional[Callable[[Dict], None]] = None,
+    progress_every: int = 100
+) -> Tuple[List[Dict], int, int]:
+    """
+    扫描脚本共用的扫描流程：复用扫描结论缓存、并发获取净值、批量检测、逐条记录命中结果
+
+    净值区间（首末日期）与上次扫描相同的基金直接复用上次结论，不再检测；
+    其余基金每获取 SCAN_CHUNK 只就批量检测一次，命中结果随即追加写入 stream_file（JSONL），
+    结论缓存同时保存，扫描中断也不丢已完成部分的结果。
+
+    Args:
+        funds: (代码, 简称) 列表
+        scan_funds: 批量检测函数，输入 (code, name, dates, prices) 列表，
+            返回一一对应的结果字典（不满足条件为 None）
+        cache_name: 扫描结论缓存名
+        params: 扫描参数，与上次不同时缓存的结论全部作废
+        stream_file: 逐条追加命中结果的 JSONL 文件
+        recent_days: 获取最近多少天的净值
+        on_hit: 每个命中结果的回调（如打印）
+        progress_every: 每扫描多少只基金打印一次进度
+
+    Returns:
+        (命中结果列表, 已扫描数, 错误数)
+    """
+    scan_cache = _load_scan_cache(cache_name, params)
+    if scan_cache:
+        print(f"已有 {len(scan_cache)} 只基金的上次扫描结论（净值未更新时跳过检测）")
+
+    hits = []
+    scanned = 0
+    errors = 0
+
+    with open(stream_file, 'wb') as stream:
+        def report(result: Dict):
+            hits.append(result)
+            stream.write(orjson.dumps(result) + b"\n")
+            stream.flush()
+            if on_hit:
+                on_hit(result)
+
+        # 已获取净值、尚未检测的基金
+        loaded = []
+
+        def detect_loaded():
+            """批量检测已获取的基金，记录结论并保存缓存"""
+            results = scan_funds(loaded) if loaded else []
+            for (code, _, dates, _), result in zip(loaded, results):
+                nav_key = _nav_key(dates)
+                if nav_key is not None:
+                    scan_cache[code] = [nav_key, result]
+                if result:
+                    report(result)
+            loaded.clear()
+            _save_scan_cache(cache_name, params, scan_cache)
+
+        # 并发获取净值，每攒够一批就检测
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+            futures = {
+                executor.submit(get_fund_data, code, recent_days): (code, name)
+                for code, name in funds
+            }
+
+            try:
+                for future in as_completed(futures):
+                    scanned += 1
+                    if scanned % progress_every == 0:
+                        print(f"进度: {scanned}/{len(funds)} ({scanned*100//len(funds)}%)")
+
+                    code, name = futures[future]
+                    try:
+                        dates, prices = future.result()
+                    except Exception:
+                        errors += 1
+                        continue
+
+                    # 净值未更新的基金直接复用上次结论
+                    cached = scan_cache.get(code)
+                    if cached is not None and cached[0] == _nav_key(dates):
+                        if cached[1]:
+                            report(cached[1])
+                    else:
+                        loaded.append((code, name, dates, prices))
+
+                    if len(loaded) >= SCAN_CHUNK:
+                        detect_loaded()
+            except BaseException:
+                # 中断时取消排队中的请求，不再等待剩余基金全部获取完
+                for future in futures:
+                    future.cancel()
+                raise
+
+        # 最后不足一批的基金
+        detect_loaded()
+
+    return hits, scanned, errors
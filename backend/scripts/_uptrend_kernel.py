@@ -0,0 +1,230 @@
+"""
+上涨阶段检测数值内核
+供 full_market_scan.py / select_new_uptrends.py 共用，安装 numba 时编译为机器码
+
+内核以 nogil=True 编译，扫描脚本的线程池在等待 AKShare 网络请求的同时，
+各线程的检测计算也能真正并行执行；未安装 numba 时改用按阶段向量化的
+numpy 实现，两者结果一致。全市场扫描通过 detect_latest_uptrends 把所有基金
+对齐成二维数组，一次批量检测
+"""
+import numpy as np
+
+from services._njit import njit, prange, HAS_NUMBA
+
+
+@njit(cache=True, nogil=True)
+def _ols_slope(prices: np.ndarray, start: int, end: int) -> float:
+    """
+    prices[start:end+1] 归一化为涨幅%后对下标做一元线性回归的斜率
+
+    闭式解 (nΣxy − ΣxΣy) / (nΣxx − (Σx)²)，等价于 np.polyfit(x, y, 1)[0]；
+    x 为 0..n-1，Σx、Σxx 直接用求和公式，循环中只累加 Σy、Σxy
+    """
+    n = end - start + 1
+    if n < 2:
+        return 0.0
+    base = prices[start]
+    sum_x = n * (n - 1) / 2
+    sum_xx = (n - 1) * n * (2 * n - 1) / 6
+    sum_y = 0.0
+    sum_xy = 0.0
+    for k in range(n):
+        y = (prices[start + k] - base) / base * 100
+        sum_y += y
+        sum_xy += k * y
+    return (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x * sum_x)
+
+
+@njit(cache=True, nogil=True)
+def _detect_uptrend_njit(prices: np.ndarray, max_dd: float, min_gain: float, min_dur: int):
+    """
+    检测上涨阶段
+
+    Returns:
+        (starts, ends, gains, slopes_first, slopes_second) 等长数组，
+        gains 为未取整的涨幅%，斜率为 %/天
+    """
+    n = len(prices)
+    starts = np.empty(n, dtype=np.int64)
+    ends = np.empty(n, dtype=np.int64)
+    gains = np.empty(n, dtype=np.float64)
+    slopes_first = np.empty(n, dtype=np.float64)
+    slopes_second = np.empty(n, dtype=np.float64)
+    count = 0
+
+    if n < min_dur:
+        return starts[:0], ends[:0], gains[:0], slopes_first[:0], slopes_second[:0]
+
+    i = 0
+    while i < n - 1:
+        if prices[i + 1] <= prices[i]:
+            i += 1
+            continue
+
+        phase_start = i
+        running_peak = prices[i]
+        running_peak_idx = i
+
+        j = i + 1
+        while j < n:
+            current_price = prices[j]
+            if current_price > running_peak:
+                running_peak = current_price
+                running_peak_idx = j
+
+            drawdown = (running_peak - current_price) / running_peak * 100
+            if drawdown > max_dd:
+                break
+            j += 1
+
+        phase_end = running_peak_idx
+
+        if phase_end > phase_start:
+            total_gain = (prices[phase_end] - prices[phase_start]) / prices[phase_start] * 100
+            duration = phase_end - phase_start
+
+            if total_gain >= min_gain and duration >= min_dur:
+                mid = duration // 2
+                starts[count] = phase_start
+                ends[count] = phase_end
+                gains[count] = total_gain
+                slopes_first[count] = _ols_slope(prices, phase_start, phase_start + mid)
+                slopes_second[count] = _ols_slope(prices, phase_start + mid, phase_end)
+                count += 1
+
+        i = max(j, phase_end + 1)
+
+    return starts[:count], ends[:count], gains[:count], slopes_first[:count], slopes_second[:count]
+
+
+def _detect_uptrend_numpy(prices: np.ndarray, max_dd: float, min_gain: float, min_dur: int):
+    """
+    检测上涨阶段（numpy 向量化版本，未安装 numba 时使用）
+
+    每个阶段用 np.maximum.accumulate 一次算出滚动峰值和回撤，
+    只在阶段之间做 Python 级循环，返回值与 _detect_uptrend_njit 相同
+    """
+    n = len(prices)
+    starts, ends, gains, slopes_first, slopes_second = [], [], [], [], []
+
+    if n >= min_dur:
+        # 标量读取走 Python float，避免逐个构造 numpy 标量
+        values = prices.tolist()
+        # 所有"下一天上涨"的起点
+        rising = np.flatnonzero(prices[1:] > prices[:-1]).tolist()
+
+        i = 0
+        for phase_start in rising:
+            if phase_start < i:
+                continue
+
+            # 按窗口逐步扩大查找第一个回撤超限点，避免每个阶段都扫描到序列末尾
+            window = 32
+            while True:
+                segment = prices[phase_start:phase_start + window]
+                peak = np.maximum.accumulate(segment)
+                breach = (peak - segment) / peak * 100 > max_dd
+                first = int(breach.argmax())
+                if breach[first]:
+                    j = phase_start + first
+                    break
+                if phase_start + window >= n:
+                    j = n
+                    break
+                window *= 4
+
+            phase_end = phase_start + int(segment[:j - phase_start].argmax())
+
+            if phase_end > phase_start:
+                total_gain = (values[phase_end] - values[phase_start]) / values[phase_start] * 100
+                duration = phase_end - phase_start
+
+                if total_gain >= min_gain and duration >= min_dur:
+                    mid = duration // 2
+                    starts.append(phase_start)
+                    ends.append(phase_end)
+                    gains.append(total_gain)
+                    slopes_first.append(_ols_slope(values, phase_start, phase_start + mid))
+                    slopes_second.append(_ols_slope(values, phase_start + mid, phase_end))
+
+            i = max(j, phase_end + 1)
+
+    return (
+        np.array(starts, dtype=np.int64),
+        np.array(ends, dtype=np.int64),
+        np.array(gains, dtype=np.float64),
+        np.array(slopes_first, dtype=np.float64),
+        np.array(slopes_second, dtype=np.float64),
+    )
+
+
+# 扫描脚本使用的入口：安装 numba 时用 JIT 内核，否则用向量化版本
+if HAS_NUMBA:
+    detect_uptrend_arrays = _detect_uptrend_njit
+else:
+    detect_uptrend_arrays = _detect_uptrend_numpy
+
+
+@njit(cache=True, parallel=True)
+def _detect_latest_batch_njit(matrix: np.ndarray, lengths: np.ndarray,
+                              max_dd: float, min_gain: float, min_dur: int):
+    """按行并行检测，每行只保留最近（最后）一个上涨阶段"""
+    n = matrix.shape[0]
+    found = np.zeros(n, dtype=np.bool_)
+    starts = np.zeros(n, dtype=np.int64)
+    ends = np.zeros(n, dtype=np.int64)
+    gains = np.zeros(n, dtype=np.float64)
+    slopes_first = np.zeros(n, dtype=np.float64)
+    slopes_second = np.zeros(n, dtype=np.float64)
+
+    for row in prange(n):
+        s, e, g, s1, s2 = _detect_uptrend_njit(matrix[row, :lengths[row]], max_dd, min_gain, min_dur)
+        if len(s) > 0:
+            found[row] = True
+            starts[row] = s[-1]
+            ends[row] = e[-1]
+            gains[row] = g[-1]
+            slopes_first[row] = s1[-1]
+            slopes_second[row] = s2[-1]
+
+    return found, starts, ends, gains, slopes_first, slopes_second
+
+
+def detect_latest_uptrends(series: list, max_dd: float, min_gain: float, min_dur: int):
+    """
+    批量检测多只基金各自最近的一个上涨阶段
+
+    各基金净值（长度可不同）按行对齐到一个二维数组，安装 numba 时由并行内核
+    一次处理完，否则逐行调用 detect_uptrend_arrays
+
+    Args:
+        series: 各基金按日期升序的净值数组列表
+
+    Returns:
+        (found, starts, ends, gains, slopes_first, slopes_second)，与 series 一一对应，
+        found 为 False 的行表示没有符合条件的上涨阶段
+    """
+    n = len(series)
+    lengths = np.fromiter((len(s) for s in series), dtype=np.int64, count=n)
+    matrix = np.zeros((n, int(lengths.max()) if n else 0), dtype=np.float64)
+    for row, values in enumerate(series):
+        matrix[row, :len(values)] = values
+
+    if HAS_NUMBA:
+        return _detect_latest_batch_njit(matrix, lengths, max_dd, min_gain, min_dur)
+
+    found = np.zeros(n, dtype=np.bool_)
+    latest = np.zeros((5, n), dtype=np.float64)
+    for row in range(n):
+        phases = detect_uptrend_arrays(matrix[row, :lengths[row]], max_dd, min_gain, min_dur)
+        if len(phases[0]) > 0:
+            found[row] = True
+            latest[:, row] = [column[-1] for column in phases]
+    return (
+        found,
+        latest[0].astype(np.int64),
+        latest[1].astype(np.int64),
+        latest[2],
+        latest[3],
+        latest[4],
+    )
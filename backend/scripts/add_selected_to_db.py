@@ -7,7 +7,7 @@ import sys
 sys.path.insert(0, '.')
 
 import json
-from database import upsert_instrument
+from database import upsert_instrument, upsert_instrument_bulk
 
 # 读取筛选结果
 with open('../docs/selected_funds.json', 'r', encoding='utf-8') as f:
@@ -16,24 +16,26 @@ with open('../docs/selected_funds.json', 'r', encoding='utf-8') as f:
 funds = data['funds']
 print(f"共 {len(funds)} 只基金需要添加到数据库")
 
-# 添加到数据库
+# 添加到数据库（单个事务批量写入，失败时逐条重试定位错误）
 added = 0
 errors = 0
 
-for i, fund in enumerate(funds, 1):
-    code = fund['code']
-    name = fund['name']
-    
-    try:
-        upsert_instrument(code, name, 'fund', source='akshare')
-        added += 1
-        
-        if i % 50 == 0:
-            print(f"进度: {i}/{len(funds)} - 已添加 {added} 只")
+rows = [(fund['code'], fund['name'], 'fund', 'akshare') for fund in funds]
+try:
+    added = upsert_instrument_bulk(rows)
+except Exception as e:
+    print(f"批量写入失败, 改为逐条写入: {e}")
+    for i, (code, name, _, source) in enumerate(rows, 1):
+        try:
+            upsert_instrument(code, name, 'fund', source=source)
+            added += 1
             
-    except Exception as e:
-        errors += 1
-        print(f"错误 {code}: {e}")
+            if i % 50 == 0:
+                print(f"进度: {i}/{len(rows)} - 已添加 {added} 只")
+                
+        except Exception as e:
+            errors += 1
+            print(f"错误 {code}: {e}")
 
 print(f"\n完成! 添加 {added} 只基金, 错误 {errors} 个")
 
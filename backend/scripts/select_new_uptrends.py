@@ -6,11 +6,11 @@
 import sys
 sys.path.insert(0, '.')
 
-import akshare as ak
-import numpy as np
-from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import json
+from datetime import datetime
+import orjson
+
+from _ak_cache import pooled_fund_requests, run_cached_scan, _load_equity_funds
+from _uptrend_kernel import detect_latest_uptrends
 
 # 筛选条件
 MIN_DURATION = 5
@@ -20,151 +20,71 @@ MAX_SLOPE = 2.0
 MAX_DRAWDOWN = 5.0
 MIN_GAIN = 5.0
 RECENT_DAYS = 60
-WORKERS = 15
+OUTPUT_FILE = '../docs/selected_funds.json'
+STREAM_FILE = '../docs/selected_funds.jsonl'  # 扫描过程中逐条追加，中断也不丢结果
+MIN_END_DATE = '2025-12-01'  # 阶段结束日期下限
 
-def get_fund_data(code: str, days: int = 365) -> list:
-    """获取基金净值数据"""
-    try:
-        df = ak.fund_open_fund_info_em(symbol=code, indicator="单位净值走势")
-        if df is None or len(df) == 0:
-            return []
-        
-        data = []
-        for _, row in df.iterrows():
-            date_str = str(row['净值日期'])
-            if '-' not in date_str:
-                date_str = f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}"
-            data.append({
-                'date': date_str,
-                'value': float(row['单位净值'])
-            })
-        
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-        start_str = start_date.strftime('%Y-%m-%d')
-        
-        return [d for d in data if d['date'] >= start_str]
-    except:
-        return []
+# 扫描结论缓存：基金净值区间未变化时直接复用上次结论，参数变化时整体作废
+SCAN_CACHE_NAME = 'select_new_uptrends'
+SCAN_PARAMS = {
+    'min_duration': MIN_DURATION, 'max_duration': MAX_DURATION, 'min_slope': MIN_SLOPE,
+    'max_slope': MAX_SLOPE, 'max_drawdown': MAX_DRAWDOWN, 'min_gain': MIN_GAIN,
+    'recent_days': RECENT_DAYS, 'min_end_date': MIN_END_DATE
+}
 
-def detect_uptrend(prices: list, dates: list):
-    """检测上涨阶段"""
-    if len(prices) < MIN_DURATION:
-        return []
-    
-    prices = np.array(prices)
-    phases = []
-    i = 0
-    
-    while i < len(prices) - 1:
-        if prices[i+1] <= prices[i]:
-            i += 1
-            continue
-        
-        phase_start = i
-        phase_start_price = prices[i]
-        running_peak = prices[i]
-        running_peak_idx = i
-        
-        j = i + 1
-        while j < len(prices):
-            current_price = prices[j]
-            if current_price > running_peak:
-                running_peak = current_price
-                running_peak_idx = j
-            
-            drawdown = (running_peak - current_price) / running_peak * 100
-            if drawdown > MAX_DRAWDOWN:
-                break
-            j += 1
-        
-        phase_end = running_peak_idx
-        
-        if phase_end > phase_start:
-            total_gain = (prices[phase_end] - phase_start_price) / phase_start_price * 100
-            duration = phase_end - phase_start
-            
-            if total_gain >= MIN_GAIN and duration >= MIN_DURATION:
-                mid = (phase_end - phase_start) // 2
-                prices_second = prices[phase_start+mid:phase_end+1]
-                
-                slope_second = 0.0
-                if len(prices_second) > 1:
-                    x2 = np.arange(len(prices_second))
-                    y2 = (prices_second - prices_second[0]) / prices_second[0] * 100
-                    slope_second = float(np.polyfit(x2, y2, 1)[0])
-                
-                phases.append({
-                    'start_date': dates[phase_start],
-                    'end_date': dates[phase_end],
-                    'duration': int(duration),
-                    'total_gain': float(round(total_gain, 2)),
-                    'slope_second': float(round(slope_second, 3))
-                })
-        
-        i = max(j, phase_end + 1)
-    
-    return phases
+def scan_funds(loaded: list) -> list:
+    """
+    批量扫描已获取净值的基金
 
-def scan_fund(code: str, name: str) -> dict | None:
-    """扫描单个基金"""
-    try:
-        data = get_fund_data(code, RECENT_DAYS)
-        if len(data) < MIN_DURATION:
-            return None
-        
-        prices = [d['value'] for d in data]
-        dates = [d['date'] for d in data]
-        
-        phases = detect_uptrend(prices, dates)
-        if not phases:
-            return None
-        
-        latest = max(phases, key=lambda p: p['end_date'])
+    Args:
+        loaded: (code, name, dates, prices) 列表
+
+    Returns:
+        与 loaded 一一对应的结果，最近的上涨阶段满足条件时为结果字典，否则为 None
+    """
+    found, starts, ends, gains, _, slopes_second = detect_latest_uptrends(
+        [prices for _, _, _, prices in loaded], MAX_DRAWDOWN, MIN_GAIN, MIN_DURATION
+    )
+    
+    results = []
+    for row, (code, name, dates, _) in enumerate(loaded):
+        result = None
+        end_date = str(dates[ends[row]]) if found[row] else ''
+        duration = int(ends[row] - starts[row])
+        slope_second = float(round(slopes_second[row], 3))
         
-        # 筛选: 结束在2025-12-01后, 持续5-10天, 斜率1-2%
-        if (latest['end_date'] >= '2025-12-01' and 
-            MIN_DURATION <= latest['duration'] <= MAX_DURATION and
-            MIN_SLOPE <= latest['slope_second'] <= MAX_SLOPE):
-            return {
+        # 筛选: 结束在MIN_END_DATE后, 持续5-10天, 斜率1-2%
+        if (found[row] and end_date >= MIN_END_DATE and 
+            MIN_DURATION <= duration <= MAX_DURATION and
+            MIN_SLOPE <= slope_second <= MAX_SLOPE):
+            result = {
                 'code': code,
                 'name': name,
-                **latest
+                'start_date': str(dates[starts[row]]),
+                'end_date': end_date,
+                'duration': duration,
+                'total_gain': float(round(gains[row], 2)),
+                'slope_second': slope_second
             }
-        return None
-    except:
-        return None
+        results.append(result)
+    return results
 
 def main():
     print("=" * 70)
     print("筛选特定条件基金: 持续5-10天, 斜率1-2%/天")
     print("=" * 70)
     
-    print("\n正在获取基金列表...")
-    df = ak.fund_name_em()
-    stock_types = ['股票型', '混合型', '股票指数', '联接基金']
-    df_filtered = df[df['基金类型'].str.contains('|'.join(stock_types), na=False)]
-    funds = [(row['基金代码'], row['基金简称']) for _, row in df_filtered.iterrows()]
-    print(f"共 {len(funds)} 只基金待扫描")
-    
-    print("\n开始扫描...")
-    selected = []
-    scanned = 0
-    
-    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
-        futures = {executor.submit(scan_fund, code, name): (code, name) for code, name in funds}
+    # 基金列表和净值请求在块内复用HTTP连接
+    with pooled_fund_requests():
+        print("\n正在获取基金列表...")
+        funds = _load_equity_funds()
+        print(f"共 {len(funds)} 只基金待扫描")
         
-        for future in as_completed(futures):
-            scanned += 1
-            if scanned % 500 == 0:
-                print(f"进度: {scanned}/{len(funds)} ({scanned*100//len(funds)}%), 已发现 {len(selected)} 只")
-            
-            try:
-                result = future.result()
-                if result:
-                    selected.append(result)
-            except:
-                pass
+        print("\n开始扫描...")
+        selected, _, _ = run_cached_scan(
+            funds, scan_funds, SCAN_CACHE_NAME, SCAN_PARAMS, STREAM_FILE, RECENT_DAYS,
+            progress_every=500
+        )
     
     selected.sort(key=lambda x: x['slope_second'], reverse=True)
     
@@ -183,8 +103,8 @@ def main():
         'funds': selected
     }
     
-    with open('../docs/selected_funds.json', 'w', encoding='utf-8') as f:
-        json.dump(output, f, ensure_ascii=False, indent=2)
+    with open(OUTPUT_FILE, 'wb') as f:
+        f.write(orjson.dumps(output, option=orjson.OPT_INDENT_2))
     
     print(f"\n结果已保存到: docs/selected_funds.json")
     
@@ -0,0 +1,22 @@
+"""
+Numba 可选依赖封装
+
+安装了 numba 时使用 @njit 编译数值内核；未安装时退化为普通 Python 函数，
+计算结果一致，只是速度较慢。
+"""
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:  # pragma: no cover - 取决于运行环境
+    HAS_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """numba.njit 的空实现，支持 @njit 和 @njit(...) 两种写法"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+
+        def decorator(func):
+            return func
+
+        return decorator
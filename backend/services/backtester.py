@@ -2,12 +2,16 @@
 急涨检测回测引擎
 使用分段斜率 + 加速度检测急涨事件
 """
+import bisect
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
-from scipy import stats
-from database import get_timeseries, list_instruments, save_surge_event, clear_surge_events, init_database
+import database
+from services._njit import njit, HAS_NUMBA
+from database import get_timeseries_arrays, list_instruments, save_surge_events_bulk, init_database, save_uptrend_phases
 
 
 @dataclass
@@ -45,6 +49,196 @@ class UptrendPhase:
     is_accelerating: bool   # 是否加速上涨
 
 
+def _ols_slope(y: np.ndarray) -> float:
+    """
+    y 对下标 0..n-1 做一元线性回归的斜率
+
+    x 为等差序列，均值 (n-1)/2 和离差平方和 n(n²-1)/12 直接由公式得到，
+    结果与 stats.linregress(np.arange(n), y).slope 一致
+    """
+    n = len(y)
+    x_centered = np.arange(n) - (n - 1) / 2
+    return float(np.dot(x_centered, y) / (n * (n * n - 1) / 12))
+
+
+def _ols_weights(n: int) -> np.ndarray:
+    """长度为 n 的序列对下标回归斜率的权重向量，斜率 = weights @ y"""
+    x_centered = np.arange(n) - (n - 1) / 2
+    return x_centered / (n * (n * n - 1) / 12)
+
+
+def _padded_ols_slopes(y: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    二维数组每一行的前 lengths[k] 个元素分别对下标回归的斜率（其余位置为填充）
+
+    每行的中心化下标在有效长度之外置零，一次逐行乘加得到所有斜率
+    """
+    cols = np.arange(y.shape[1])
+    lengths = lengths[:, None]
+    x_centered = np.where(cols < lengths, cols - (lengths - 1) / 2, 0.0)
+    n = lengths[:, 0]
+    return np.einsum('ij,ij->i', x_centered, y) / (n * (n * n - 1) / 12)
+
+
+def _segment_slopes_batch(
+    prices: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    一次计算多个阶段 prices[start:end+1] 的分段斜率，与逐个调用
+    UptrendPhaseDetector._calculate_segment_slopes 的结果一致（仅求和顺序不同）
+
+    所有阶段按最长阶段补齐成二维数组，前后半段各做一次批量回归
+    """
+    n = ends - starts + 1
+    mid = n // 2
+    cols = np.arange(n.max())
+    
+    # 阶段内归一化为涨幅%，补齐部分取阶段起点价格（随后被回归权重置零）
+    idx = np.minimum(starts[:, None] + cols, len(prices) - 1)
+    idx = np.where(cols < n[:, None], idx, starts[:, None])
+    y = (prices[idx] / prices[starts][:, None] - 1) * 100
+    
+    rows = np.arange(len(starts))
+    second_idx = np.minimum(mid[:, None] + cols, y.shape[1] - 1)
+    second = y[rows[:, None], second_idx] - y[rows, mid][:, None]
+    
+    # 不足4个点的阶段半段长度可能为1（离差平方和为0），结果随后被覆盖
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 前半段
+        slope1 = _padded_ols_slopes(y, mid)
+        
+        # 后半段（以中点为新起点）
+        slope2 = _padded_ols_slopes(second, n - mid)
+        
+        # 不足4个点时不计算斜率
+        short = n < 4
+        slope1[short] = 0.0
+        slope2[short] = 0.0
+        
+        # 加速度
+        acceleration = np.where(
+            slope1 > 0.01,
+            slope2 / slope1,
+            np.where(slope2 > 0, np.inf, 0.0)
+        )
+    acceleration[short] = 1.0
+    
+    return slope1, slope2, acceleration
+
+
+@njit(cache=True)
+def _find_valid_phase_end_nb(prices: np.ndarray, tolerance: float) -> int:
+    """找到不超过回撤阈值的有效阶段结束点（回撤超限时返回此前峰值位置）"""
+    if len(prices) < 2:
+        return 0
+    
+    peak = prices[0]
+    peak_idx = 0
+    
+    for i in range(1, len(prices)):
+        if prices[i] > peak:
+            peak = prices[i]
+            peak_idx = i
+        else:
+            # 检查回撤
+            drawdown = (peak - prices[i]) / peak * 100
+            if drawdown > tolerance:
+                return peak_idx
+    
+    return len(prices) - 1
+
+
+@njit(cache=True)
+def _max_drawdown_nb(prices: np.ndarray) -> float:
+    """计算最大回撤%"""
+    if len(prices) < 2:
+        return 0.0
+    
+    peak = prices[0]
+    max_dd = 0.0
+    
+    for price in prices:
+        if price > peak:
+            peak = price
+        dd = (peak - price) / peak * 100
+        if dd > max_dd:
+            max_dd = dd
+    
+    return max_dd
+
+
+def _find_valid_phase_end_np(prices: np.ndarray, tolerance: float) -> int:
+    """_find_valid_phase_end_nb 的 numpy 向量化版本（滚动峰值 + 首个回撤超限点）"""
+    if len(prices) < 2:
+        return 0
+    
+    peak = np.maximum.accumulate(prices)
+    breach = (peak - prices) / peak * 100 > tolerance
+    first = int(breach.argmax())
+    if not breach[first]:
+        return len(prices) - 1
+    return int(prices[:first].argmax())
+
+
+def _max_drawdown_np(prices: np.ndarray) -> float:
+    """_max_drawdown_nb 的 numpy 向量化版本"""
+    if len(prices) < 2:
+        return 0.0
+    
+    peak = np.maximum.accumulate(prices)
+    return float(((peak - prices) / peak * 100).max())
+
+
+# 有 numba 时用编译后的标量循环，否则用向量化版本（numba 不支持 ufunc.accumulate）
+_find_valid_phase_end_impl = _find_valid_phase_end_nb if HAS_NUMBA else _find_valid_phase_end_np
+_max_drawdown_impl = _max_drawdown_nb if HAS_NUMBA else _max_drawdown_np
+
+
+def _iter_phase_candidates(prices: np.ndarray, tolerance: float):
+    """
+    依次产出候选上涨阶段 (起点, 峰值位置)
+
+    起点为"下一天上涨"的位置；每个阶段用 np.maximum.accumulate 一次算出滚动峰值
+    和回撤，找到第一个回撤超过 tolerance 的点，阶段结束于此前的峰值。
+    查找窗口按需扩大，避免每个阶段都扫描到序列末尾；Python 只按阶段循环。
+    """
+    n = len(prices)
+    rising = np.flatnonzero(prices[1:] > prices[:-1]).tolist()
+    
+    next_start = 0
+    for start in rising:
+        if start < next_start:
+            continue
+        
+        window = 32
+        while True:
+            segment = prices[start:start + window]
+            peak = np.maximum.accumulate(segment)
+            breach = (peak - segment) / peak * 100 > tolerance
+            first = int(breach.argmax())
+            if breach[first]:
+                stop = start + first
+                break
+            if start + window >= n:
+                stop = n
+                break
+            window *= 4
+        
+        peak_idx = start + int(segment[:stop - start].argmax())
+        yield start, peak_idx
+        
+        # 移动到下一个可能的起点
+        next_start = max(stop, peak_idx + 1)
+
+
+# 同步时预计算上涨阶段所用参数，API请求参数不低于这些阈值时可直接查表
+PRECOMPUTED_MAX_DRAWDOWN = 5.0
+PRECOMPUTED_MIN_GAIN = 5.0
+PRECOMPUTED_MIN_DURATION = 3
+
+
 class UptrendPhaseDetector:
     """
     连续上涨阶段检测器
@@ -63,51 +257,30 @@ class UptrendPhaseDetector:
         self.min_gain = min_gain
         self.min_duration = min_duration
     
-    def detect_phases(self, code: str, name: str = "") -> List[UptrendPhase]:
-        """检测基金的所有上涨阶段"""
-        data = get_timeseries(code)
+    def detect_phases(
+        self,
+        code: str,
+        name: str = "",
+        dates: Optional[Tuple[str, ...]] = None,
+        prices: Optional[np.ndarray] = None
+    ) -> List[UptrendPhase]:
+        """
+        检测基金的所有上涨阶段
+
+        dates/prices 可传入已加载的序列，与其他检测器共用一次加载；缺省时从数据库读取
+        """
+        if prices is None:
+            dates, prices = get_timeseries_arrays(code)
         
-        if not data or len(data) < self.min_duration:
+        if len(prices) < self.min_duration:
             return []
         
-        prices = np.array([float(d['value']) for d in data])
-        dates = [d['date'] for d in data]
-        
-        phases = []
-        i = 0
+        # 先筛选出有效阶段 (起点, 终点, 总涨幅, 最大回撤)，斜率在最后一次批量计算
+        accepted = []
         
-        while i < len(prices) - 1:
-            # 寻找上涨起点（当前价格低于下一个价格）
-            if prices[i+1] <= prices[i]:
-                i += 1
-                continue
-            
-            # 开始一个新的上涨阶段
-            phase_start = i
-            phase_start_price = prices[i]
-            running_peak = prices[i]
-            running_peak_idx = i
-            
-            j = i + 1
-            while j < len(prices):
-                current_price = prices[j]
-                
-                # 更新峰值
-                if current_price > running_peak:
-                    running_peak = current_price
-                    running_peak_idx = j
-                
-                # 计算从峰值的回撤
-                drawdown_from_peak = (running_peak - current_price) / running_peak * 100
-                
-                # 如果回撤超过阈值，结束当前阶段
-                if drawdown_from_peak > self.max_drawdown_tolerance:
-                    break
-                
-                j += 1
-            
-            # 阶段结束于峰值位置（不包含回撤部分）
-            phase_end = running_peak_idx
+        # 逐个候选阶段，阶段结束于峰值位置（不包含回撤部分）
+        for phase_start, phase_end in _iter_phase_candidates(prices, self.max_drawdown_tolerance):
+            phase_start_price = prices[phase_start]
             
             # 验证：确保这个阶段内的最大回撤确实不超过阈值
             # 通过滑动窗口检查每个点相对于前面峰值的回撤
@@ -127,72 +300,46 @@ class UptrendPhaseDetector:
                     if total_gain >= self.min_gain and duration >= self.min_duration:
                         # 计算期间最大回撤
                         max_dd = self._calculate_max_drawdown(actual_prices)
-                        
-                        # 计算分段斜率
-                        slope_first, slope_second, acceleration = self._calculate_segment_slopes(actual_prices)
-                        
-                        phases.append(UptrendPhase(
-                            code=code,
-                            name=name,
-                            start_date=dates[phase_start],
-                            end_date=dates[actual_end],
-                            start_idx=phase_start,
-                            end_idx=actual_end,
-                            duration_days=duration,
-                            total_gain=round(total_gain, 2),
-                            max_drawdown=round(max_dd, 2),
-                            avg_daily_gain=round(total_gain / duration, 3),
-                            peak_date=dates[actual_end],
-                            peak_gain=round(total_gain, 2),
-                            slope_first=round(slope_first, 3),
-                            slope_second=round(slope_second, 3),
-                            is_accelerating=bool(acceleration > 1.3)
-                        ))
-            
-            # 移动到下一个可能的起点
-            i = max(j, phase_end + 1)
+                        accepted.append((phase_start, actual_end, total_gain, max_dd))
+        
+        if not accepted:
+            return []
+        
+        # 所有阶段的分段斜率一次算出
+        starts = np.array([a[0] for a in accepted])
+        ends = np.array([a[1] for a in accepted])
+        slopes_first, slopes_second, accelerations = _segment_slopes_batch(prices, starts, ends)
+        
+        phases = []
+        for k, (phase_start, actual_end, total_gain, max_dd) in enumerate(accepted):
+            duration = actual_end - phase_start
+            phases.append(UptrendPhase(
+                code=code,
+                name=name,
+                start_date=dates[phase_start],
+                end_date=dates[actual_end],
+                start_idx=phase_start,
+                end_idx=actual_end,
+                duration_days=duration,
+                total_gain=round(total_gain, 2),
+                max_drawdown=round(max_dd, 2),
+                avg_daily_gain=round(total_gain / duration, 3),
+                peak_date=dates[actual_end],
+                peak_gain=round(total_gain, 2),
+                slope_first=round(float(slopes_first[k]), 3),
+                slope_second=round(float(slopes_second[k]), 3),
+                is_accelerating=bool(accelerations[k] > 1.3)
+            ))
         
         return phases
     
     def _find_valid_phase_end(self, prices: np.ndarray) -> int:
         """找到不超过回撤阈值的有效阶段结束点"""
-        if len(prices) < 2:
-            return 0
-        
-        peak = prices[0]
-        peak_idx = 0
-        valid_end = 0
-        
-        for i in range(1, len(prices)):
-            if prices[i] > peak:
-                peak = prices[i]
-                peak_idx = i
-                valid_end = i  # 更新有效结束点
-            else:
-                # 检查回撤
-                drawdown = (peak - prices[i]) / peak * 100
-                if drawdown > self.max_drawdown_tolerance:
-                    # 回撤超过阈值，返回峰值位置
-                    return peak_idx
-        
-        return len(prices) - 1
+        return _find_valid_phase_end_impl(prices, self.max_drawdown_tolerance)
     
     def _calculate_max_drawdown(self, prices: np.ndarray) -> float:
         """计算最大回撤"""
-        if len(prices) < 2:
-            return 0.0
-        
-        peak = prices[0]
-        max_dd = 0.0
-        
-        for price in prices:
-            if price > peak:
-                peak = price
-            dd = (peak - price) / peak * 100
-            if dd > max_dd:
-                max_dd = dd
-        
-        return max_dd
+        return _max_drawdown_impl(prices)
     
     def _calculate_segment_slopes(self, prices: np.ndarray) -> Tuple[float, float, float]:
         """计算分段斜率"""
@@ -206,14 +353,10 @@ class UptrendPhaseDetector:
         y = (prices / prices[0] - 1) * 100
         
         # 前半段
-        x1 = np.arange(mid)
-        y1 = y[:mid]
-        slope1, _, _, _, _ = stats.linregress(x1, y1)
+        slope1 = _ols_slope(y[:mid])
         
         # 后半段
-        x2 = np.arange(n - mid)
-        y2 = y[mid:] - y[mid]
-        slope2, _, _, _, _ = stats.linregress(x2, y2)
+        slope2 = _ols_slope(y[mid:] - y[mid])
         
         # 加速度
         if slope1 > 0.01:
@@ -224,6 +367,30 @@ class UptrendPhaseDetector:
         return slope1, slope2, acceleration
 
 
+def precompute_uptrend_phases(code: str, name: str = "") -> int:
+    """
+    检测并保存基金的上涨阶段，供 /api/uptrend_phases 直接查询
+
+    阶段划分只取决于回撤阈值，min_gain/min_duration 只是过滤条件，
+    因此按最宽松的过滤条件保存，查询时再用SQL过滤。
+    涨幅保存未取整的值（与检测器判断 min_gain 时的算式相同），
+    SQL 过滤与实时检测对边界值的取舍一致。
+    """
+    detector = UptrendPhaseDetector(
+        max_drawdown_tolerance=PRECOMPUTED_MAX_DRAWDOWN,
+        min_gain=PRECOMPUTED_MIN_GAIN,
+        min_duration=PRECOMPUTED_MIN_DURATION
+    )
+    dates, prices = get_timeseries_arrays(code)
+    phases = detector.detect_phases(code, name, dates, prices)
+    return save_uptrend_phases(code, [
+        (p.start_date, p.end_date, p.duration_days,
+         float((prices[p.end_idx] - prices[p.start_idx]) / prices[p.start_idx] * 100),
+         p.max_drawdown, p.avg_daily_gain, p.slope_first, p.slope_second, p.is_accelerating)
+        for p in phases
+    ])
+
+
 class SurgeDetector:
     """急涨检测器"""
     
@@ -236,6 +403,17 @@ class SurgeDetector:
         self.min_gain = min_gain
         self.min_slope = min_slope
         self.acceleration_threshold = acceleration_threshold
+        
+        # 窗口大小固定，前后半段的回归权重预先算好，按序列长度（window + 1）索引
+        self._weights: Dict[int, Tuple[np.ndarray, np.ndarray]] = {
+            window + 1: self._segment_weights(window + 1) for window in windows
+        }
+    
+    @staticmethod
+    def _segment_weights(n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """长度为 n 的序列前半段、后半段的回归斜率权重"""
+        mid = n // 2
+        return _ols_weights(mid), _ols_weights(n - mid)
     
     def calculate_segment_slopes(self, prices: np.ndarray) -> Tuple[float, float, float]:
         """
@@ -246,19 +424,17 @@ class SurgeDetector:
         """
         n = len(prices)
         mid = n // 2
+        weights = self._weights.get(n)
+        w1, w2 = weights if weights is not None else self._segment_weights(n)
         
         # 归一化为涨幅%
         y = (prices / prices[0] - 1) * 100
         
         # 前半段
-        x1 = np.arange(mid)
-        y1 = y[:mid]
-        slope1, _, _, _, _ = stats.linregress(x1, y1)
+        slope1 = float(w1 @ y[:mid])
         
-        # 后半段
-        x2 = np.arange(n - mid)
-        y2 = y[mid:] - y[mid]  # 以中点为新起点
-        slope2, _, _, _, _ = stats.linregress(x2, y2)
+        # 后半段（以中点为新起点）
+        slope2 = float(w2 @ (y[mid:] - y[mid]))
         
         # 加速度
         if slope1 > 0.01:  # 避免除零
@@ -298,72 +474,158 @@ class SurgeDetector:
         
         return is_surge, details
     
-    def scan_fund(self, code: str, name: str = "") -> List[SurgeEvent]:
-        """扫描单个基金的急涨事件"""
+    def scan_fund(
+        self,
+        code: str,
+        name: str = "",
+        dates: Optional[Tuple[str, ...]] = None,
+        prices: Optional[np.ndarray] = None
+    ) -> List[SurgeEvent]:
+        """
+        扫描单个基金的急涨事件
+
+        dates/prices 可传入已加载的序列，与其他检测器共用一次加载；缺省时从数据库读取
+        """
         events = []
-        data = get_timeseries(code)
+        if prices is None:
+            dates, prices = get_timeseries_arrays(code)
         
-        if not data or len(data) < max(self.windows) + 1:
+        if len(prices) < max(self.windows) + 1:
             return events
         
-        prices = np.array([float(d['value']) for d in data])
-        dates = [d['date'] for d in data]
-        
-        # 记录已检测的区间，避免重复
-        detected_ranges = set()
+        # 收集所有窗口命中的候选区间 [起点, 终点]（价格下标）
+        starts, ends, gains, slopes1, slopes2, window_sizes = [], [], [], [], [], []
         
         for window in self.windows:
-            for i in range(window, len(prices)):
-                window_prices = prices[i-window:i+1]
-                is_surge_event, details = self.is_surge(window_prices)
-                
-                if is_surge_event:
-                    start_date = dates[i-window]
-                    end_date = dates[i]
-                    
-                    # 检查是否与已检测区间重叠
-                    range_key = f"{start_date}_{end_date}"
-                    if range_key in detected_ranges:
-                        continue
-                    detected_ranges.add(range_key)
-                    
-                    events.append(SurgeEvent(
-                        code=code,
-                        name=name,
-                        start_date=start_date,
-                        end_date=end_date,
-                        window=window,
-                        total_gain=details['total_gain'],
-                        slope_first=details['slope_first'],
-                        slope_second=details['slope_second'],
-                        acceleration=details['acceleration'],
-                        is_accelerating=details['is_accelerating']
-                    ))
-        
-        # 按日期排序并去重
-        events.sort(key=lambda e: e.end_date)
+            # 所有滑动窗口一次性计算，每行对应 is_surge(prices[i-window:i+1])
+            # 先用首尾价格算总涨幅和日均斜率，只有通过这两个条件的窗口才计算分段斜率
+            total_gain = (prices[window:] / prices[:-window] - 1) * 100
+            avg_slope = total_gain / (window + 1)
+            rows = np.flatnonzero((total_gain >= self.min_gain) & (avg_slope >= self.min_slope))
+            
+            view = np.lib.stride_tricks.sliding_window_view(prices, window + 1)[rows]
+            y = (view / view[:, :1] - 1) * 100
+            mid = (window + 1) // 2
+            
+            w1, w2 = self._weights.get(window + 1) or self._segment_weights(window + 1)
+            slope1 = y[:, :mid] @ w1
+            slope2 = (y[:, mid:] - y[:, mid:mid+1]) @ w2
+            
+            # 急涨条件：后半段仍在上涨
+            rising = slope2 > 0
+            rows = rows[rising]
+            starts.append(rows)
+            ends.append(rows + window)
+            gains.append(total_gain[rows])
+            slopes1.append(slope1[rising])
+            slopes2.append(slope2[rising])
+            window_sizes.append(np.full(len(rows), window))
+        
+        starts, ends, gains = np.concatenate(starts), np.concatenate(ends), np.concatenate(gains)
+        slopes1, slopes2 = np.concatenate(slopes1), np.concatenate(slopes2)
+        window_sizes = np.concatenate(window_sizes)
+        
+        # 重叠区间只保留涨幅最大的一个：按涨幅从高到低依次尝试，
+        # 与已保留区间（互不重叠、按起点有序）重叠则跳过；首尾相接不算重叠
+        kept_starts: List[int] = []
+        kept_ends: List[int] = []
+        kept_rows: List[int] = []
+        for row in np.lexsort((starts, -gains)).tolist():
+            s, e = int(starts[row]), int(ends[row])
+            pos = bisect.bisect_left(kept_starts, s)
+            if pos > 0 and kept_ends[pos - 1] > s:
+                continue
+            if pos < len(kept_starts) and kept_starts[pos] < e:
+                continue
+            kept_starts.insert(pos, s)
+            kept_ends.insert(pos, e)
+            kept_rows.insert(pos, row)
+        
+        # 保留区间互不重叠，按起点有序即按结束日期有序
+        for row in kept_rows:
+            if slopes1[row] > 0.01:
+                acceleration = slopes2[row] / slopes1[row]
+            else:
+                acceleration = float('inf') if slopes2[row] > 0 else 0
+            
+            events.append(SurgeEvent(
+                code=code,
+                name=name,
+                start_date=dates[starts[row]],
+                end_date=dates[ends[row]],
+                window=int(window_sizes[row]),
+                total_gain=round(float(gains[row]), 2),
+                slope_first=round(float(slopes1[row]), 3),
+                slope_second=round(float(slopes2[row]), 3),
+                acceleration=round(float(acceleration), 2),
+                is_accelerating=bool(acceleration > self.acceleration_threshold)
+            ))
+        
         return events
 
 
+def _init_scan_worker(db_path) -> None:
+    """扫描子进程初始化：使用与主进程相同的数据库（spawn 启动时模块状态不会继承）"""
+    database.DB_PATH = db_path
+
+
+def _scan_one(
+    args: Tuple[str, str, "SurgeDetector", Optional["UptrendPhaseDetector"]]
+) -> Tuple[List[SurgeEvent], Optional[List[UptrendPhase]]]:
+    """扫描单只基金（模块级函数，可被进程池序列化），两个检测器共用一次数据加载"""
+    code, name, detector, phase_detector = args
+    dates, prices = get_timeseries_arrays(code)
+    events = detector.scan_fund(code, name, dates, prices)
+    phases = None
+    if phase_detector is not None:
+        phases = phase_detector.detect_phases(code, name, dates, prices)
+    return events, phases
+
+
 class SurgeBacktester:
     """回测引擎"""
     
-    def __init__(self):
+    def __init__(self, phase_detector: Optional[UptrendPhaseDetector] = None):
         self.detector = SurgeDetector()
         self.all_events: List[SurgeEvent] = []
+        # 可选的上涨阶段检测器，与急涨检测共用每只基金的一次数据加载
+        self.phase_detector = phase_detector
+        self.all_phases: Dict[str, List[UptrendPhase]] = {}
     
-    def scan_all_funds(self) -> List[SurgeEvent]:
-        """扫描数据库中所有基金"""
+    def scan_all_funds(self, max_workers: Optional[int] = None) -> List[SurgeEvent]:
+        """
+        扫描数据库中所有基金
+
+        各基金互不相关，按 CPU 核数分配到多个进程并行扫描（每个进程使用自己的
+        SQLite 连接，WAL 模式下并发读互不阻塞）；max_workers <= 1 时在当前进程内顺序扫描
+        """
         instruments = list_instruments(instrument_type='fund')
+        workers = max_workers or os.cpu_count() or 1
         
         print(f"开始扫描 {len(instruments)} 只基金...")
         
-        for i, inst in enumerate(instruments):
+        tasks = [
+            (inst['code'], inst['name'], self.detector, self.phase_detector)
+            for inst in instruments
+        ]
+        if workers > 1 and len(tasks) > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=min(workers, len(tasks)),
+                initializer=_init_scan_worker,
+                initargs=(database.DB_PATH,)
+            )
+            with executor:
+                results = list(executor.map(_scan_one, tasks, chunksize=8))
+        else:
+            results = map(_scan_one, tasks)
+        
+        for i, (inst, (events, phases)) in enumerate(zip(instruments, results)):
             code = inst['code']
             name = inst['name']
             
-            events = self.detector.scan_fund(code, name)
             self.all_events.extend(events)
+            if phases is not None:
+                self.all_phases[code] = phases
             
             if events:
                 print(f"  [{i+1}/{len(instruments)}] {name}({code}): 发现 {len(events)} 个急涨事件")
@@ -401,19 +663,12 @@ class SurgeBacktester:
     
     def save_to_database(self) -> int:
         """保存急涨事件到数据库"""
-        clear_surge_events()  # 清空旧数据
-        
-        for e in self.all_events:
-            save_surge_event(
-                code=e.code,
-                start_date=e.start_date,
-                end_date=e.end_date,
-                window=e.window,
-                total_gain=e.total_gain,
-                slope_first=e.slope_first,
-                slope_second=e.slope_second,
-                is_accelerating=e.is_accelerating
-            )
+        # 清空旧数据并批量写入，单个事务
+        save_surge_events_bulk((
+            (e.code, e.start_date, e.end_date, e.window, e.total_gain,
+             e.slope_first, e.slope_second, e.is_accelerating)
+            for e in self.all_events
+        ), replace_all=True)
         
         print(f"已保存 {len(self.all_events)} 个急涨事件到数据库")
         return len(self.all_events)
@@ -434,10 +689,14 @@ if __name__ == "__main__":
         min_duration=5                # 最少5天
     )
     
+    # 两个检测器在同一次扫描中共用每只基金的数据加载
+    backtester = SurgeBacktester(phase_detector=phase_detector)
+    events = backtester.scan_all_funds()
+    
     instruments = list_instruments(instrument_type='fund')[:5]  # 测试前5个
     
     for inst in instruments:
-        phases = phase_detector.detect_phases(inst['code'], inst['name'])
+        phases = backtester.all_phases.get(inst['code'], [])
         if phases:
             print(f"\n{inst['name']} ({inst['code']}):")
             for p in phases[:3]:  # 只显示前3个
@@ -453,8 +712,6 @@ if __name__ == "__main__":
     print("原有固定窗口急涨检测")
     print("=" * 60)
     
-    backtester = SurgeBacktester()
-    events = backtester.scan_all_funds()
     backtester.save_to_database()
     print(backtester.generate_report())
 
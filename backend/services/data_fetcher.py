@@ -2,17 +2,54 @@
 数据摄取模块 - 使用AKShare获取外部数据
 遵循PRD v1.1第3章节：仅用于数据摄取，不允许UI或业务层直接访问
 """
+import threading
+import time
 import akshare as ak
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
+from itertools import repeat
 from typing import Optional, List, Dict, Tuple
 from database import (
     upsert_instrument,
-    upsert_timeseries,
+    upsert_timeseries_bulk,
     update_sync_state,
     get_sync_state
 )
 
+FUND_LIST_TTL = 86400  # 全量基金列表缓存有效期（秒）
+
+_fund_list_lock = threading.Lock()
+_fund_list_cache: Optional[Tuple[float, pd.DataFrame]] = None
+
+
+def _get_all_funds() -> pd.DataFrame:
+    """
+    获取全量基金列表（ak.fund_name_em，约一万行），以基金代码为索引
+
+    进程内缓存24小时；加锁下载，并发同步时只请求一次
+    """
+    global _fund_list_cache
+    with _fund_list_lock:
+        if _fund_list_cache is not None and time.monotonic() < _fund_list_cache[0]:
+            return _fund_list_cache[1]
+        all_funds = ak.fund_name_em()
+        all_funds = all_funds.drop_duplicates('基金代码').set_index('基金代码')
+        _fund_list_cache = (time.monotonic() + FUND_LIST_TTL, all_funds)
+        return all_funds
+
+
+def _lookup_fund(code: str) -> Optional[Dict]:
+    """从全量基金列表中按代码查找名称和类型，找不到返回None"""
+    all_funds = _get_all_funds()
+    if code not in all_funds.index:
+        return None
+    return {
+        "code": code,
+        "name": all_funds.at[code, '基金简称'],
+        "type": all_funds.at[code, '基金类型']
+    }
+
 
 class DataFetcher:
     """AKShare数据抓取器"""
@@ -37,30 +74,17 @@ class DataFetcher:
             if df is None or len(df) == 0:
                 # 尝试用另一个接口获取名称（如果之前那个不行）
                 try:
-                    all_funds = ak.fund_name_em()
-                    fund_row = all_funds[all_funds['基金代码'] == code]
-                    if not fund_row.empty:
-                        return {
-                            "code": code,
-                            "name": fund_row.iloc[0]['基金简称'],
-                            "type": fund_row.iloc[0]['基金类型']
-                        }
-                except:
-                    pass
-                return None
+                    return _lookup_fund(code)
+                except Exception:
+                    return None
             
             # 这里API其实只返回净值，不返回名称，需要用 fund_name_em 获取名称
-            # 为了效率，我们先尝试直接从全量列表中查
+            # 为了效率，我们先尝试直接从全量列表中查（列表在进程内缓存）
             try:
-                all_funds = ak.fund_name_em()
-                fund_row = all_funds[all_funds['基金代码'] == code]
-                if not fund_row.empty:
-                    return {
-                        "code": code,
-                        "name": fund_row.iloc[0]['基金简称'],
-                        "type": fund_row.iloc[0]['基金类型']
-                    }
-            except:
+                info = _lookup_fund(code)
+                if info is not None:
+                    return info
+            except Exception:
                 pass
                 
             return {
@@ -117,44 +141,42 @@ class DataFetcher:
 
             # 3. 计算复权净值 (前复权)
             if has_dividends:
-                # 解析分红金额
-                import re
-                def parse_dividend(text):
-                    match = re.search(r'([0-9.]+)元', str(text))
-                    return float(match.group(1)) if match else 0
-
-                # 解析分红日期和金额
-                dividends = []
-                for _, row in div_df.iterrows():
-                    try:
-                        div_date = pd.to_datetime(row['权益登记日'])
-                        div_amount = parse_dividend(row['每份分红'])
-                        if div_amount > 0:
-                            dividends.append({'date': div_date, 'amount': div_amount})
-                    except Exception:
-                        continue
+                # 解析分红日期和金额（整列处理）：日期无法解析或金额不是正数的记录忽略
+                div_dates = pd.to_datetime(
+                    div_df['权益登记日'], errors='coerce', format='mixed'
+                ).to_numpy(dtype='datetime64[ns]')
+                div_amounts = pd.to_numeric(
+                    div_df['每份分红'].astype(str).str.extract(r'([0-9.]+)元', expand=False),
+                    errors='coerce'
+                ).fillna(0).to_numpy(dtype=np.float64)
+                keep = ~np.isnat(div_dates) & (div_amounts > 0)
 
                 # 按日期排序
-                dividends = sorted(dividends, key=lambda x: x['date'])
+                order = np.argsort(div_dates[keep], kind='stable')
+                div_dates = div_dates[keep][order]
+                div_amounts = div_amounts[keep][order]
 
                 # 计算复权因子 (从最早到最新累积)
+                # 每笔分红对"分红日之后"的净值乘入 (1 + extra_ratio)：按分红顺序累乘得到
+                # 各笔分红后的累计因子，再按每个净值日期之前已生效的分红笔数取值，O(N+D)
+                nav_dates = nav_df['净值日期'].to_numpy()
+                nav_values = nav_df['单位净值'].to_numpy(dtype=np.float64)
                 nav_df['adj_factor'] = 1.0
 
-                for div in dividends:
-                    div_date = div['date']
-                    div_amount = div['amount']
-
-                    # 找到分红日当天或之前的净值
-                    mask = nav_df['净值日期'] <= div_date
-                    if mask.any():
-                        # 获取分红日的净值
-                        div_nav = nav_df.loc[mask, '单位净值'].iloc[-1]
-                        if div_nav > 0:
-                            # 分红再投资获得的额外份额比例
-                            extra_ratio = div_amount / div_nav
-                            # 分红日之后的数据需要乘以 (1 + extra_ratio)
-                            after_mask = nav_df['净值日期'] > div_date
-                            nav_df.loc[after_mask, 'adj_factor'] *= (1 + extra_ratio)
+                if len(div_dates):
+                    # 分红日当天或之前的净值条数，即分红生效的起始位置
+                    div_idx = np.searchsorted(nav_dates, div_dates, side='right')
+                    div_navs = np.full(len(div_dates), np.nan)
+                    has_nav = div_idx > 0
+                    div_navs[has_nav] = nav_values[div_idx[has_nav] - 1]
+
+                    # 分红再投资获得的额外份额比例
+                    valid = div_navs > 0
+                    cum_factors = np.concatenate((
+                        [1.0], np.cumprod(1 + div_amounts[valid] / div_navs[valid])
+                    ))
+                    applied = np.searchsorted(div_idx[valid], np.arange(len(nav_df)), side='right')
+                    nav_df['adj_factor'] = cum_factors[applied]
 
                 # 复权净值 = 单位净值 * 复权因子
                 nav_df['value'] = nav_df['单位净值'] * nav_df['adj_factor']
@@ -289,6 +311,47 @@ class DataFetcher:
             print(f"Error fetching index history for {code}: {e}")
             return pd.DataFrame(columns=["date", "value"])
 
+    def _write_history(
+        self,
+        code: str,
+        history_df: pd.DataFrame,
+        message: str
+    ) -> Tuple[int, Optional[str]]:
+        """
+        将历史数据一次性批量写入数据库，并在同一事务中把同步状态更新为成功
+
+        Args:
+            code: 基金/指数代码
+            history_df: 历史数据（非空）
+            message: 同步状态消息，其中 {count} 替换为写入条数
+
+        Returns:
+            (写入条数, 最后日期)
+        """
+
+        # 整列转换为 Python 列表后再拼行，避免逐个装箱 pandas/numpy 标量
+        dates = history_df['date'].tolist()
+        rows = zip(
+            repeat(code, len(dates)),
+            dates,
+            history_df['value'].astype(float).tolist(),
+            repeat(self.source_version, len(dates))
+        )
+        last_date = dates[-1]
+        count = upsert_timeseries_bulk(
+            rows,
+            sync_state=(code, last_date, "success", message.format(count=len(dates)))
+        )
+        return count, last_date
+
+    def _resume_date(self, code: str) -> Optional[str]:
+        """上次成功同步日期的下一天，没有同步记录时返回None"""
+        sync_state = get_sync_state(code)
+        if sync_state and sync_state.get("last_success_date"):
+            last_date = datetime.strptime(sync_state["last_success_date"], "%Y-%m-%d")
+            return (last_date + timedelta(days=1)).strftime("%Y-%m-%d")
+        return None
+
     def sync_to_database(
         self,
         code: str,
@@ -307,13 +370,17 @@ class DataFetcher:
             (成功状态, 消息)
         """
         try:
+            # 已有同步记录时只写入上次同步之后的数据（复权因子仍按全量历史计算，
+            # 已入库的数据不受影响）
+            start_date = self._resume_date(code)
+
             # 1. 获取基本信息
             if instrument_type == "fund":
                 info = self.fetch_fund_info(code)
-                history_df = self.fetch_fund_history(code)
+                history_df = self.fetch_fund_history(code, start_date)
             elif instrument_type == "index":
                 info = self.fetch_index_info(code)
-                history_df = self.fetch_index_history(code)
+                history_df = self.fetch_index_history(code, start_date)
             else:
                 return False, f"Unsupported type: {instrument_type}"
 
@@ -321,32 +388,13 @@ class DataFetcher:
                 return False, f"Failed to fetch info for {code}"
 
             if history_df.empty:
+                if start_date:
+                    return True, "No new data to sync"
                 return False, f"No history data for {code}"
 
-            # 2. 批量写入时间序列数据
-            success_count = 0
-            last_date = None
-
-            for _, row in history_df.iterrows():
-                try:
-                    upsert_timeseries(
-                        code=code,
-                        date=row['date'],
-                        value=float(row['value']),
-                        source_version=self.source_version
-                    )
-                    success_count += 1
-                    last_date = row['date']
-                except Exception as e:
-                    print(f"Error inserting {code} on {row['date']}: {e}")
-                    continue
-
-            # 3. 更新同步状态
-            update_sync_state(
-                code=code,
-                last_success_date=last_date,
-                status="success",
-                message=f"Synced {success_count} records"
+            # 2. 批量写入时间序列数据，同步状态在同一事务中更新
+            success_count, _ = self._write_history(
+                code, history_df, "Synced {count} records"
             )
 
             return True, f"Successfully synced {success_count} records for {code}"
@@ -371,14 +419,10 @@ class DataFetcher:
         Returns:
             (成功状态, 消息)
         """
-        # 获取上次同步状态
-        sync_state = get_sync_state(code)
+        # 从上次同步的下一天开始
+        start_date = self._resume_date(code)
 
-        if sync_state and sync_state.get("last_success_date"):
-            # 从上次同步的下一天开始
-            last_date = datetime.strptime(sync_state["last_success_date"], "%Y-%m-%d")
-            start_date = (last_date + timedelta(days=1)).strftime("%Y-%m-%d")
-        else:
+        if not start_date:
             # 首次同步，拉取3年数据
             start_date = (datetime.now() - timedelta(days=365 * 3)).strftime("%Y-%m-%d")
 
@@ -396,30 +440,9 @@ class DataFetcher:
             if history_df.empty:
                 return True, "No new data to sync"
 
-            # 批量写入
-            success_count = 0
-            last_date = None
-
-            for _, row in history_df.iterrows():
-                try:
-                    upsert_timeseries(
-                        code=code,
-                        date=row['date'],
-                        value=float(row['value']),
-                        source_version=self.source_version
-                    )
-                    success_count += 1
-                    last_date = row['date']
-                except Exception as e:
-                    print(f"Error inserting {code} on {row['date']}: {e}")
-                    continue
-
-            # 更新同步状态
-            update_sync_state(
-                code=code,
-                last_success_date=last_date,
-                status="success",
-                message=f"Incremental sync: {success_count} new records"
+            # 批量写入，同步状态在同一事务中更新
+            success_count, _ = self._write_history(
+                code, history_df, "Incremental sync: {count} new records"
             )
 
             return True, f"Incremental sync: {success_count} new records"
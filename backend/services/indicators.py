@@ -2,19 +2,181 @@
 技术指标计算服务
 用于计算基金的相对强度、动量、波动率等指标，帮助识别潜在急涨信号
 """
-import pandas as pd
 import numpy as np
-from typing import Dict, Optional, List
-from database import get_timeseries
+from dataclasses import dataclass
+from typing import Dict, Optional, List, Tuple
+from database import get_timeseries_arrays, get_timeseries_batch, save_indicators
+from services._njit import njit, HAS_NUMBA
+
+# 各信号按档位取标签，档位由比较结果（布尔值）相加得到，与得分一致
+_RS_LABELS = ("跑输大盘", "略微跑赢", "强势跑赢")                  # (rs>0) + (rs>5)
+_MOMENTUM_LABELS = ("下跌趋势", None, "趋势向上", "上涨动能强")   # 1 - (m<-5) + (m>0) + (m>10)
+_VOL_RATIO_LABELS = (None, "波动收窄", "波动压缩(蓄势)")           # (v<0.8) + (v<0.6)
+_WARNING_LEVELS = ("LOW", "MEDIUM", "HIGH")                         # (score>=2) + (score>=4)
+
+
+def _volatility(values: np.ndarray) -> np.ndarray:
+    """
+    每一行日收益率的样本标准差（%），与 pandas 的 pct_change().std() 一致
+
+    values 为 (K, N) 矩阵，返回长度 K 的数组；收益率不足2个时为 NaN。
+    平方和用 einsum 逐行点积一次求出，不再生成离差数组
+    """
+    returns = values[:, 1:] / values[:, :-1]
+    returns -= 1
+    n = returns.shape[1]
+    if n < 2:
+        return np.full(len(values), np.nan)
+    mean = returns.sum(axis=1) / n
+    sum_sq = np.einsum('ij,ij->i', returns, returns)
+    var = np.maximum(sum_sq - n * mean * mean, 0.0) / (n - 1)
+    return np.sqrt(var) * 100
+
+
+def _rolling_volatility(values: np.ndarray, w: int) -> np.ndarray:
+    """
+    每一行上所有连续 w 个日收益率窗口的样本标准差（%），用累积和滑动求得
+
+    values 为 (K, N) 矩阵，返回 (K, N-w)，第 j 列对应收益率 j..j+w-1（即 values[:, j:j+w+1]）。
+    窗口和与平方和由 cumsum 相减得到，整段历史 O(N)；收益率先减去每行第一个值再累加，
+    避免原始矩公式 (Σr² - (Σr)²/w) 的相消误差
+    """
+    returns = values[:, 1:] / values[:, :-1] - 1
+    returns = returns - returns[:, :1]
+    zeros = np.zeros((len(returns), 1))
+    cs = np.concatenate((zeros, np.cumsum(returns, axis=1)), axis=1)
+    cs2 = np.concatenate((zeros, np.cumsum(returns * returns, axis=1)), axis=1)
+    s = cs[:, w:] - cs[:, :-w]
+    s2 = cs2[:, w:] - cs2[:, :-w]
+    var = np.maximum(s2 - s * s / w, 0.0) / (w - 1)
+    return np.sqrt(var) * 100
+
+
+@njit(cache=True)
+def _window_volatility_nb(values: np.ndarray, start: int, end: int) -> float:
+    """values[start:end] 日收益率的样本标准差（%），Welford 单次遍历，收益率不足2个时为 NaN"""
+    count = 0
+    mean = 0.0
+    m2 = 0.0
+    for j in range(start, end - 1):
+        r = values[j + 1] / values[j] - 1
+        count += 1
+        delta = r - mean
+        mean += delta / count
+        m2 += delta * (r - mean)
+    if count < 2:
+        return np.nan
+    return np.sqrt(m2 / (count - 1)) * 100
+
+
+@njit(cache=True)
+def _indicator_core_nb(values: np.ndarray, days: int) -> Tuple[float, float, float]:
+    """
+    单只基金的 (动量%, 当前周期波动率%, 前一周期波动率%)，调用方保证 len(values) >= days + 1；
+    数据不足两个周期时前一周期波动率为 NaN
+    """
+    n = len(values)
+    window = days + 1
+    start_price = values[n - window]
+    momentum = ((values[n - 1] - start_price) / start_price) * 100
+    volatility = _window_volatility_nb(values, n - window, n)
+    prev_volatility = np.nan
+    if n >= window * 2:
+        prev_volatility = _window_volatility_nb(values, n - window * 2, n - window)
+    return momentum, volatility, prev_volatility
+
+
+@dataclass
+class IndicatorResult:
+    """单只基金的技术指标结果，接口返回前用 to_dict() 转为字典"""
+    __slots__ = (
+        "fund_code", "period_days", "momentum", "relative_strength", "index_return",
+        "volatility", "vol_ratio", "analysis", "warning_level", "score",
+    )
+    fund_code: str
+    period_days: int
+    momentum: float           # 动量（涨跌幅%）
+    relative_strength: float  # 相对强度（vs 基准指数）
+    index_return: float       # 基准指数涨幅%
+    volatility: float         # 波动率%
+    vol_ratio: float          # 波动率压缩比
+    analysis: List[str]       # 信号说明
+    warning_level: str        # 预警等级 (HIGH/MEDIUM/LOW，数据不足为 NONE)
+    score: int
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
 
 
 class IndicatorService:
     """技术指标计算服务"""
     
+    # 同步时预计算的周期（前端默认使用20天指标）
+    PRECOMPUTED_PERIODS = (20,)
+
     def __init__(self):
         self.index_code = '000300'  # 使用沪深300作为基准指数
+        # 基准指数区间涨幅，key 为 (周期, 数据条数, 最后日期)，指数数据更新后自动换新 key
+        self._index_returns: Dict[Tuple[int, int, str], float] = {}
+
+    def _get_index_return(self, days: int) -> float:
+        """
+        基准指数最近 days 天的涨幅%，数据不足时为0
+
+        同一批基金的指标计算中结果都相同，按指数数据指纹缓存；
+        指数序列本身由 get_timeseries_arrays 缓存，不会每只基金都读库
+        """
+        index_dates, index_values = get_timeseries_arrays(self.index_code)
+        if len(index_values) < days + 1:
+            return 0
+
+        key = (days, len(index_dates), index_dates[-1])
+        index_return = self._index_returns.get(key)
+        if index_return is None:
+            idx_current = index_values[-1]
+            idx_start = index_values[-(days + 1)]
+            index_return = ((idx_current - idx_start) / idx_start) * 100
+            if len(self._index_returns) >= 64:
+                self._index_returns.clear()
+            self._index_returns[key] = index_return
+        return index_return
+
+    def current_index_date(self) -> str:
+        """基准指数数据的最后日期（没有数据时为空字符串），预计算结果按它判断是否过期"""
+        index_dates, _ = get_timeseries_arrays(self.index_code)
+        return index_dates[-1] if index_dates else ""
+
+    def precompute(self, fund_code: str) -> int:
+        """
+        计算并保存基金在预设周期下的指标，供 /api/indicators 直接查询
+
+        结果记录计算所用的基准指数日期，指数之后再更新时 get_latest_indicators 不再返回它；
+        计算期间指数恰好更新时不保存（无法确定用的是哪一版指数数据）
+
+        Returns:
+            保存的指标条数
+        """
+        dates, _ = get_timeseries_arrays(fund_code)
+        if not dates:
+            return 0
+
+        index_date = self.current_index_date()
+        results = [
+            (days, self.calculate_indicators(fund_code, days))
+            for days in self.PRECOMPUTED_PERIODS
+        ]
+        if self.current_index_date() != index_date:
+            return 0
 
-    def calculate_indicators(self, fund_code: str, days: int = 20) -> Dict:
+        saved = 0
+        for days, result in results:
+            if result.warning_level == "NONE":  # 数据不足
+                continue
+            save_indicators(fund_code, dates[-1], days, result.to_dict(), index_date)
+            saved += 1
+        return saved
+
+    def calculate_indicators(self, fund_code: str, days: int = 20) -> IndicatorResult:
         """
         计算基金的技术指标
         
@@ -23,123 +185,149 @@ class IndicatorService:
             days: 计算周期 (默认20天，约1个月交易日)
             
         Returns:
-            包含 RS、动量、波动率等指标的字典
+            包含 RS、动量、波动率等指标的 IndicatorResult
         """
-        # 1. 获取数据
-        fund_data = get_timeseries(fund_code)
-        index_data = get_timeseries(self.index_code)
-        
-        if not fund_data or len(fund_data) < days + 1:
+        if not HAS_NUMBA:
+            return self.calculate_indicators_batch([fund_code], days)[0]
+
+        # 单只基金直接走编译后的内核，免去批量路径的矩阵构造
+        _, fund_values = get_timeseries_arrays(fund_code)
+        if len(fund_values) < days + 1:
             return self._empty_result("数据不足")
 
-        # 转换为 DataFrame 并取最近 N+1 天
-        fund_df = pd.DataFrame(fund_data)
-        fund_df['value'] = pd.to_numeric(fund_df['value'])
-        fund_df = fund_df.tail(days + 1).reset_index(drop=True)
-        
-        # 2. 计算动量 (Momentum)
-        current_price = fund_df.iloc[-1]['value']
-        start_price = fund_df.iloc[0]['value']
-        momentum = ((current_price - start_price) / start_price) * 100
+        momentum, volatility, prev_volatility = _indicator_core_nb(fund_values, days)
+        return self._score(
+            [fund_code], days, np.array([momentum]), self._get_index_return(days),
+            np.array([volatility]), np.array([prev_volatility])
+        )[0]
+
+    def calculate_indicators_batch(
+        self, fund_codes: List[str], days: int = 20
+    ) -> List[IndicatorResult]:
+        """
+        批量计算多只基金的技术指标
+
+        所有基金的序列一次查询取回，最近 N+1 天对齐成 (K, N+1) 矩阵，
+        动量、波动率和评分都对所有基金一次算出
+
+        Returns:
+            与 fund_codes 顺序一致的 IndicatorResult 列表
+        """
+        # 1. 获取数据
+        series = get_timeseries_batch(fund_codes)
+        window = days + 1
+        enough = [code for code in fund_codes if len(series[code][1]) >= window]
         
-        # 3. 计算相对强度 (Relative Strength)
-        index_return = 0
-        if index_data and len(index_data) >= days + 1:
-            idx_df = pd.DataFrame(index_data)
-            idx_df['value'] = pd.to_numeric(idx_df['value'])
-            idx_df = idx_df.tail(days + 1).reset_index(drop=True)
+        computed: Dict[str, IndicatorResult] = {}
+        if enough:
+            # 数据足够两个周期的基金取最近 2(N+1) 天，其余只取最近 N+1 天；
+            # 每只基金的尾段只复制一次，当前周期窗口就是矩阵的最后 N+1 列
+            long_rows = [
+                k for k, code in enumerate(enough) if len(series[code][1]) >= window * 2
+            ] if days >= 2 else []
+            short_rows = sorted(set(range(len(enough))) - set(long_rows))
             
-            idx_current = idx_df.iloc[-1]['value']
-            idx_start = idx_df.iloc[0]['value']
-            index_return = ((idx_current - idx_start) / idx_start) * 100
+            momentums = np.empty(len(enough))
+            volatilities = np.empty(len(enough))
+            prev_volatilities = np.full(len(enough), np.nan)  # 没有前一周期的为 NaN
+            for rows, length in ((long_rows, window * 2), (short_rows, window)):
+                if not rows:
+                    continue
+                tails = np.stack([series[enough[k]][1][-length:] for k in rows])
+                
+                # 2. 计算动量 (Momentum)
+                current_price = tails[:, -1]
+                start_price = tails[:, -window]
+                momentums[rows] = ((current_price - start_price) / start_price) * 100
+                
+                # 3. 计算波动率 (Volatility) 和前一个周期的波动率
+                if length > window:
+                    # 一次滑动计算同时得到两个周期的波动率
+                    rolling = _rolling_volatility(tails, days)
+                    volatilities[rows] = rolling[:, -1]
+                    prev_volatilities[rows] = rolling[:, -1 - window]
+                else:
+                    volatilities[rows] = _volatility(tails)
+            
+            # 4. 相对强度所需的基准涨幅对所有基金相同
+            index_return = self._get_index_return(days)
             
-        rs_value = momentum - index_return
+            computed = dict(zip(enough, self._score(
+                enough, days, momentums, index_return, volatilities, prev_volatilities
+            )))
+        
+        return [
+            computed[code] if code in computed else self._empty_result("数据不足")
+            for code in fund_codes
+        ]
 
-        # 4. 计算波动率 (Volatility)
-        fund_df['daily_return'] = fund_df['value'].pct_change()
-        volatility = fund_df['daily_return'].std() * 100
+    def _score(
+        self,
+        fund_codes: List[str],
+        days: int,
+        momentums: np.ndarray,
+        index_return: float,
+        volatilities: np.ndarray,
+        prev_volatilities: np.ndarray
+    ) -> List[IndicatorResult]:
+        """
+        由各基金的动量、基准涨幅和波动率生成分析、评分和预警等级
+
+        三项信号的档位和得分由阈值比较的布尔值相加，对所有基金一次求出，
+        不再逐个基金走 if/elif 分支；prev_volatilities 中 NaN 表示没有前一周期
+        """
+        rs_values = momentums - index_return
         
-        # 5. 计算波动率压缩比 (与前一个周期对比)
-        if len(fund_data) >= (days + 1) * 2:
-            prev_df = pd.DataFrame(fund_data)
-            prev_df['value'] = pd.to_numeric(prev_df['value'])
-            prev_df = prev_df.tail((days + 1) * 2).head(days + 1).reset_index(drop=True)
-            prev_df['daily_return'] = prev_df['value'].pct_change()
-            prev_volatility = prev_df['daily_return'].std() * 100
-            
-            if prev_volatility > 0:
-                vol_ratio = volatility / prev_volatility
-            else:
-                vol_ratio = 1.0
-        else:
-            vol_ratio = 1.0
+        # 波动率压缩比 (与前一个周期对比)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vol_ratios = np.where(
+                prev_volatilities > 0, volatilities / prev_volatilities, 1.0
+            )
         
-        # 6. 生成分析和评分
-        analysis = []
-        score = 0
+        # 各信号档位：比较结果直接相加，不走分支；NaN 比较均为假，落在最低档（动量为无信号档）
+        rs_grades = (rs_values > 0).astype(np.intp) + (rs_values > 5)
+        momentum_scores = (momentums > 0).astype(np.intp) + (momentums > 10)
+        momentum_grades = momentum_scores + 1 - (momentums < -5)
+        vol_grades = (vol_ratios < 0.8).astype(np.intp) + (vol_ratios < 0.6)
         
-        # RS 信号
-        if rs_value > 5:
-            analysis.append("强势跑赢")
-            score += 2
-        elif rs_value > 0:
-            analysis.append("略微跑赢")
-            score += 1
-        else:
-            analysis.append("跑输大盘")
-            
-        # 动量信号
-        if momentum > 10:
-            analysis.append("上涨动能强")
-            score += 2
-        elif momentum > 0:
-            analysis.append("趋势向上")
-            score += 1
-        elif momentum < -5:
-            analysis.append("下跌趋势")
-            
-        # 波动率压缩信号
-        if vol_ratio < 0.6:
-            analysis.append("波动压缩(蓄势)")
-            score += 2
-        elif vol_ratio < 0.8:
-            analysis.append("波动收窄")
-            score += 1
-
         # 综合判断
-        if score >= 4:
-            warning_level = "HIGH"
-        elif score >= 2:
-            warning_level = "MEDIUM"
-        else:
-            warning_level = "LOW"
-            
-        return {
-            "fund_code": fund_code,
-            "period_days": days,
-            "momentum": round(momentum, 2),
-            "relative_strength": round(rs_value, 2),
-            "index_return": round(index_return, 2),
-            "volatility": round(volatility, 3),
-            "vol_ratio": round(vol_ratio, 2),
-            "analysis": analysis,
-            "warning_level": warning_level,
-            "score": score
-        }
-
-    def _empty_result(self, reason: str) -> Dict:
-        return {
-            "fund_code": "",
-            "period_days": 0,
-            "momentum": 0,
-            "relative_strength": 0,
-            "index_return": 0,
-            "volatility": 0,
-            "vol_ratio": 1,
-            "analysis": [reason],
-            "warning_level": "NONE",
-            "score": 0
-        }
+        scores = rs_grades + momentum_scores + vol_grades
+        levels = (scores >= 2).astype(np.intp) + (scores >= 4)
+        
+        results = []
+        for k, fund_code in enumerate(fund_codes):
+            labels = (
+                _RS_LABELS[rs_grades[k]],
+                _MOMENTUM_LABELS[momentum_grades[k]],
+                _VOL_RATIO_LABELS[vol_grades[k]],
+            )
+            results.append(IndicatorResult(
+                fund_code=fund_code,
+                period_days=days,
+                momentum=round(momentums[k], 2),
+                relative_strength=round(rs_values[k], 2),
+                index_return=round(index_return, 2),
+                volatility=round(volatilities[k], 3),
+                vol_ratio=round(vol_ratios[k], 2),
+                analysis=[label for label in labels if label is not None],
+                warning_level=_WARNING_LEVELS[levels[k]],
+                score=int(scores[k])
+            ))
+        return results
+
+    def _empty_result(self, reason: str) -> IndicatorResult:
+        return IndicatorResult(
+            fund_code="",
+            period_days=0,
+            momentum=0,
+            relative_strength=0,
+            index_return=0,
+            volatility=0,
+            vol_ratio=1,
+            analysis=[reason],
+            warning_level="NONE",
+            score=0
+        )
 
 
 # 单例
@@ -3,22 +3,88 @@
 遵循PRD v1.1第9章节：后台触发增量同步，完成后刷新该行
 """
 import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict, Optional, Callable
+from typing import AsyncIterator, List, Dict, Optional, Callable, Set, Tuple
 from services.data_fetcher import DataFetcher
-from database import get_instrument_info, list_instruments
+from services.backtester import precompute_uptrend_phases
+from services.indicators import indicator_service
+from database import get_instrument_info, list_instrument_codes
+
+
+# 同步最大并发数，可通过环境变量 SYNC_CONCURRENCY 调整
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", "8"))
 
 
 class SyncService:
     """后台数据同步服务"""
 
-    def __init__(self):
+    def __init__(self, max_concurrency: int = SYNC_CONCURRENCY):
         self.fetcher = DataFetcher()
-        self.syncing: set = set()  # 正在同步的代码集合
+        # 正在同步（含排队等待）的代码 -> 同步任务，同一代码的并发请求共享一个任务
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.max_concurrency = max_concurrency
+        # 所有同步请求共享的并发上限，多个批量同步同时进行时总并发也不超过该值
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # 阻塞的同步过程在专用线程池中执行，线程数与并发上限一致
+        # （默认线程池按CPU核数确定大小，少核机器上会低于并发上限）
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="sync"
+        )
+
+    @property
+    def syncing(self) -> Set[str]:
+        """正在同步（含排队等待）的代码集合"""
+        return set(self._inflight)
 
     def is_syncing(self, code: str) -> bool:
         """检查是否正在同步"""
-        return code in self.syncing
+        return code in self._inflight
+
+    def _sync_blocking(self, code: str) -> Tuple[bool, str]:
+        """单个代码的同步全过程（阻塞），在线程池中执行"""
+        # 获取基金类型
+        info = get_instrument_info(code)
+
+        if not info:
+            # 首次同步，默认为fund类型
+            instrument_type = "fund"
+        else:
+            instrument_type = info["type"]
+
+        # 执行增量同步
+        success, message = self.fetcher.incremental_sync(code, instrument_type)
+
+        # 数据更新后重新计算上涨阶段和技术指标；数据已经提交，
+        # 预计算失败只记录日志，不影响同步结果，查询时会回退到实时计算
+        if success:
+            for precompute in (precompute_uptrend_phases, indicator_service.precompute):
+                try:
+                    precompute(code)
+                except Exception as e:
+                    print(f"Error precomputing {precompute.__name__} for {code}: {e}")
+
+        return success, message
+
+    async def _run_sync(self, code: str) -> Dict:
+        """执行一次同步并构造结果字典（异常也转换为失败结果）"""
+        try:
+            async with self._semaphore:
+                # 网络请求和数据库读写都是阻塞调用，放到线程池执行，不阻塞事件循环
+                loop = asyncio.get_running_loop()
+                success, message = await loop.run_in_executor(
+                    self._executor, self._sync_blocking, code
+                )
+        except Exception as e:
+            success, message = False, str(e)
+
+        return {
+            "code": code,
+            "success": success,
+            "message": message,
+            "timestamp": datetime.now().isoformat()
+        }
 
     async def sync_single(
         self,
@@ -28,6 +94,8 @@ class SyncService:
         """
         同步单个基金/指数
 
+        同一代码正在同步时不会重复发起，而是等待并共享进行中的那次同步的结果
+
         Args:
             code: 基金/指数代码
             on_progress: 进度回调函数
@@ -35,74 +103,87 @@ class SyncService:
         Returns:
             同步结果字典
         """
-        if code in self.syncing:
-            return {
-                "code": code,
-                "success": False,
-                "message": "Already syncing",
-                "timestamp": datetime.now().isoformat()
-            }
-
-        self.syncing.add(code)
+        # 检查与登记之间没有 await，事件循环内不会被其他协程插入
+        task = self._inflight.get(code)
+        if task is None:
+            task = asyncio.ensure_future(self._run_sync(code))
+            self._inflight[code] = task
+            task.add_done_callback(lambda _: self._inflight.pop(code, None))
 
-        try:
-            # 获取基金类型
-            info = get_instrument_info(code)
-
-            if not info:
-                # 首次同步，默认为fund类型
-                instrument_type = "fund"
-            else:
-                instrument_type = info["type"]
-
-            # 执行增量同步
-            success, message = self.fetcher.incremental_sync(code, instrument_type)
-
-            result = {
-                "code": code,
-                "success": success,
-                "message": message,
-                "timestamp": datetime.now().isoformat()
-            }
+        # shield：某个调用方被取消时不影响其他等待同一同步的调用方
+        result = await asyncio.shield(task)
 
-            if on_progress:
-                await on_progress(result)
+        if on_progress:
+            await on_progress(result)
 
-            return result
+        return result
 
-        except Exception as e:
-            result = {
-                "code": code,
-                "success": False,
-                "message": str(e),
-                "timestamp": datetime.now().isoformat()
-            }
+    async def _sync_indexed(
+        self,
+        codes: List[str],
+        on_progress: Optional[Callable],
+        max_concurrency: Optional[int]
+    ) -> AsyncIterator[Tuple[int, Dict]]:
+        """并发同步多个代码，按完成顺序逐个产出 (在 codes 中的下标, 结果)"""
+        batch_limit = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+
+        async def run(index: int, code: str):
+            if batch_limit is None:
+                return index, await self.sync_single(code, on_progress)
+            async with batch_limit:
+                return index, await self.sync_single(code, on_progress)
+
+        tasks = [asyncio.ensure_future(run(i, code)) for i, code in enumerate(codes)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # 调用方提前停止迭代时取消尚未完成的等待（同步任务本身受 shield 保护，不受影响）
+            for task in tasks:
+                task.cancel()
 
-            if on_progress:
-                await on_progress(result)
+    async def sync_multiple_iter(
+        self,
+        codes: List[str],
+        on_progress: Optional[Callable] = None,
+        max_concurrency: Optional[int] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        并发同步多个基金/指数，按完成顺序逐个产出结果
 
-            return result
+        调用方可以边同步边处理结果，不必等全部完成、也不必持有全部结果
 
-        finally:
-            self.syncing.discard(code)
+        Args:
+            codes: 基金/指数代码列表
+            on_progress: 进度回调函数
+            max_concurrency: 本批次的并发上限（在全局上限之内进一步限制），默认不额外限制
+        """
+        async for _, result in self._sync_indexed(codes, on_progress, max_concurrency):
+            yield result
 
     async def sync_multiple(
         self,
         codes: List[str],
-        on_progress: Optional[Callable] = None
+        on_progress: Optional[Callable] = None,
+        max_concurrency: Optional[int] = None
     ) -> List[Dict]:
         """
-        并发同步多个基金/指数
+        并发同步多个基金/指数（并发数受全局 max_concurrency 限制）
+
+        结果按完成顺序逐个收集，on_progress 随每个代码完成即时触发
 
         Args:
             codes: 基金/指数代码列表
             on_progress: 进度回调函数
+            max_concurrency: 本批次的并发上限（在全局上限之内进一步限制），默认不额外限制
 
         Returns:
-            同步结果列表
+            同步结果列表，与 codes 顺序一致
         """
-        tasks = [self.sync_single(code, on_progress) for code in codes]
-        return await asyncio.gather(*tasks)
+        results: List[Optional[Dict]] = [None] * len(codes)
+        async for index, result in self._sync_indexed(codes, on_progress, max_concurrency):
+            results[index] = result
+        return results
 
     async def sync_all(
         self,
@@ -117,8 +198,7 @@ class SyncService:
         Returns:
             同步结果列表
         """
-        instruments = list_instruments()
-        codes = [inst["code"] for inst in instruments]
+        codes = list_instrument_codes()
 
         if not codes:
             return []
@@ -145,10 +225,12 @@ async def background_sync_task(
         try:
             print(f"[{datetime.now()}] Starting background sync...")
 
-            results = await sync_service.sync_multiple(codes)
-
-            success_count = sum(1 for r in results if r["success"])
-            print(f"Background sync completed: {success_count}/{len(results)} succeeded")
+            # 边完成边计数，不保留每个代码的结果
+            success_count = total = 0
+            async for result in sync_service.sync_multiple_iter(codes):
+                total += 1
+                success_count += result["success"]
+            print(f"Background sync completed: {success_count}/{total} succeeded")
 
         except Exception as e:
             print(f"Background sync error: {e}")
@@ -0,0 +1,58 @@
+"""
+快速测试脚本 - 验证后端功能
+
+用法（在 backend 目录下执行）:
+    python smoke_test.py
+"""
+from database import init_database, list_instruments, get_timeseries, get_uptrend_phases
+from services.backtester import UptrendPhaseDetector, precompute_uptrend_phases
+from services.data_fetcher import DataFetcher
+
+print("=== 基金趋势实验室 - 后端测试 ===\n")
+
+# 1. 初始化数据库
+print("1. 初始化数据库...")
+init_database()
+print("   ✅ 数据库初始化完成\n")
+
+# 2. 测试数据抓取
+print("2. 测试数据抓取（以沪深300指数为例）...")
+fetcher = DataFetcher()
+
+# 同步沪深300指数
+success, message = fetcher.sync_to_database("000300", "index")
+print(f"   {'✅' if success else '❌'} 同步结果: {message}\n")
+
+# 3. 验证数据
+print("3. 验证数据库...")
+instruments = list_instruments()
+print(f"   ✅ 找到 {len(instruments)} 只基金/指数")
+
+if instruments:
+    timeseries = get_timeseries("000300")
+    print(f"   ✅ 沪深300有 {len(timeseries)} 条数据")
+    if timeseries:
+        print(f"      最新: {timeseries[-1]['date']} = {timeseries[-1]['value']}")
+        print(f"      最旧: {timeseries[0]['date']} = {timeseries[0]['value']}")
+
+# 4. 预计算上涨阶段与实时检测结果一致
+print("\n4. 核对预计算上涨阶段与实时检测...")
+PHASE_FIELDS = (
+    "start_date", "end_date", "duration_days", "total_gain", "max_drawdown",
+    "avg_daily_gain", "slope_first", "slope_second", "is_accelerating"
+)
+precompute_uptrend_phases("000300")
+for min_gain, min_duration in ((10.0, 5), (5.0, 3), (7.5, 4), (1000.0, 5)):
+    stored = get_uptrend_phases("000300", min_gain, min_duration)
+    live = UptrendPhaseDetector(
+        max_drawdown_tolerance=5.0, min_gain=min_gain, min_duration=min_duration
+    ).detect_phases("000300")
+    same = stored is not None and [tuple(p[f] for f in PHASE_FIELDS) for p in stored] == [
+        tuple(getattr(p, f) for f in PHASE_FIELDS) for p in live
+    ]
+    print(f"   {'✅' if same else '❌'} min_gain={min_gain}, min_duration={min_duration}: "
+          f"预计算 {len(stored or [])} 个 / 实时 {len(live)} 个")
+
+print("\n=== 测试完成 ===")
+print("\n提示: 如果测试通过，可以启动后端服务：")
+print("  python3 -m uvicorn main:app --reload --port 8000")
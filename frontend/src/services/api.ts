@@ -5,6 +5,7 @@ import axios from 'axios';
 import type {
   Instrument,
   TimeseriesPoint,
+  ColumnarTimeseries,
   UIState,
   SyncStatus
 } from '../types';
@@ -205,35 +206,45 @@ export async function getUptrendPhases(
 
 // ==================== 时间序列数据 ====================
 
+/**
+ * 列式时间序列转换为点数组
+ */
+function fromColumnar({ dates, values }: ColumnarTimeseries): TimeseriesPoint[] {
+  return dates.map((date, i) => ({ date, value: values[i] }));
+}
+
 /**
  * 获取时间序列数据
+ * 以列式格式传输，减小响应体积和后端序列化开销
  */
 export async function getTimeseries(
   code: string,
   startDate?: string,
   endDate?: string
 ): Promise<TimeseriesPoint[]> {
-  const response = await api.post<TimeseriesPoint[]>('/timeseries', {
+  const response = await api.post<ColumnarTimeseries>('/timeseries', {
     code,
     start_date: startDate,
-    end_date: endDate
+    end_date: endDate,
+    columnar: true
   });
-  return response.data;
+  return fromColumnar(response.data);
 }
 
 /**
  * 按天数范围获取时间序列数据
+ * 以列式格式传输，减小响应体积和后端序列化开销
  */
 export async function getTimeseriesByRange(
   code: string,
   days: number,
   endDate?: string
 ): Promise<TimeseriesPoint[]> {
-  const response = await api.get<TimeseriesPoint[]>(
+  const response = await api.get<ColumnarTimeseries>(
     `/timeseries/${code}/range/${days}`,
-    { params: { end_date: endDate } }
+    { params: { end_date: endDate, columnar: true } }
   );
-  return response.data;
+  return fromColumnar(response.data);
 }
 
 /**
@@ -18,6 +18,12 @@ export interface TimeseriesPoint {
   value: number;
 }
 
+// 列式时间序列（后端 columnar=true 时返回）
+export interface ColumnarTimeseries {
+  dates: string[];
+  values: number[];
+}
+
 // 时间区间配置
 export interface TimeRange {
   days: number;